@@ -0,0 +1,171 @@
+import io
+import os
+import sys
+
+from idAllocator import IDAllocator
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from server.coordinates import parseCoordinates, parseLocus, encodeCoordinates
+
+# Bulk loading for the loader scripts. IDs come in large blocks from the
+# shared allocator, rows are buffered per table and written with COPY FROM
+# STDIN in large transactions. Indexes and foreign keys of the loaded tables
+# are dropped for the load and created again at the end. Coordinates are
+# packed as they are loaded, like server.system.packCoordinates does, into
+# the tables that have a packedCoordinates column.
+
+deferLock = 'marpodb_bulk_loader_indexes'
+
+def coordinatesText(value):
+	# Coordinate lists, e.g. the exons of an UTR, as "start,end;start,end"
+	if isinstance(value, (list, tuple)):
+		return ';'.join( ','.join(str(v) for v in item) if isinstance(item, (list, tuple)) else str(item) for item in value )
+	return value
+
+def packedCoordinates(table, coordinates):
+	coordinates = coordinatesText(coordinates)
+	if table == 'locus':
+		return encodeCoordinates( parseLocus(coordinates)[1] )
+	return encodeCoordinates( parseCoordinates(coordinates) )
+
+def copyValue(value):
+	if value is None:
+		return '\\N'
+	if isinstance(value, bytes):
+		# bytea in hex format, its backslash escaped below like any other
+		value = '\\x' + value.hex()
+	if isinstance(value, (list, tuple)):
+		value = coordinatesText(value)
+	return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+class BulkLoader(object):
+
+	def __init__(self, conn, prefix = 'mpdb', batchSize = 50000):
+		self.conn = conn
+		self.cur = conn.cursor()
+		self.prefix = prefix
+		self.batchSize = batchSize
+
+		self.ids = IDAllocator(conn, prefix, blockSize = 10000)
+		self.tables = []
+		self.rows = {}
+		self.nRows = 0
+		self.locked = False
+		self.packedTables = {}
+
+	def hasPackedCoordinates(self, table):
+		# Looked up once per table, older schemas have no packed column
+		if not table in self.packedTables:
+			self.cur.execute("SELECT 1 FROM information_schema.columns WHERE table_name = %s AND column_name = 'packedCoordinates'", (table,))
+			self.packedTables[table] = self.cur.fetchone() is not None
+
+		return self.packedTables[table]
+
+	def newID(self, table):
+		return self.ids.newID(table)
+
+	def insertRow(self, table, valuesDict):
+		nid = self.newID(table)
+		valuesDict['id'] = nid
+
+		if valuesDict.get('coordinates') is not None and self.hasPackedCoordinates(table):
+			try:
+				valuesDict['packedCoordinates'] = packedCoordinates(table, valuesDict['coordinates'])
+			except ValueError:
+				# Left for packCoordinates to report
+				pass
+
+		if not table in self.rows:
+			self.tables.append(table)
+			self.rows[table] = []
+		self.rows[table].append(valuesDict)
+
+		self.nRows += 1
+		if self.nRows >= self.batchSize:
+			self.flush()
+
+		return nid
+
+	def flush(self):
+		# Tables are written in the order they were first used, so that rows
+		# come after the rows they refer to
+		for table in self.tables:
+			rows = self.rows[table]
+			if not rows:
+				continue
+
+			columns = []
+			for row in rows:
+				for column in row:
+					if not column in columns:
+						columns.append(column)
+
+			data = io.StringIO()
+			for row in rows:
+				data.write( '\t'.join( copyValue(row.get(column)) for column in columns ) + '\n' )
+			data.seek(0)
+
+			self.cur.copy_expert("COPY {0} ({1}) FROM STDIN".format(table, ','.join( '"{0}"'.format(column) for column in columns )), data)
+			self.rows[table] = []
+
+		self.nRows = 0
+		self.conn.commit()
+
+	def deferIndexes(self, tables):
+		# Drops the foreign keys and secondary indexes of the tables. Their
+		# definitions are stored in the database in the same transaction, so
+		# a load that dies leaves them behind for the next loader to restore.
+		# Only the loader holding the advisory lock defers indexes, the
+		# others load with the indexes as they are.
+		self.cur.execute("SELECT pg_try_advisory_lock(hashtext(%s))", (deferLock,))
+		if not self.cur.fetchone()[0]:
+			self.conn.commit()
+			return False
+		self.locked = True
+
+		self.cur.execute("CREATE TABLE IF NOT EXISTS bulk_loader_deferred (position serial PRIMARY KEY, definition text NOT NULL)")
+		self._restore()
+
+		deferred = []
+		drops = []
+
+		self.cur.execute("SELECT conrelid::regclass::text, conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE contype = 'f' AND conrelid::regclass::text = ANY(%s)", (list(tables),))
+		for table, name, definition in self.cur.fetchall():
+			deferred.append( "ALTER TABLE {0} ADD CONSTRAINT {1} {2}".format(table, name, definition) )
+			drops.append( "ALTER TABLE {0} DROP CONSTRAINT {1}".format(table, name) )
+
+		self.cur.execute("SELECT i.indexrelid::regclass::text, pg_get_indexdef(i.indexrelid) FROM pg_index i WHERE i.indrelid::regclass::text = ANY(%s) AND NOT i.indisprimary AND NOT i.indisunique", (list(tables),))
+		for name, definition in self.cur.fetchall():
+			deferred.insert(0, definition)
+			drops.append( "DROP INDEX {0}".format(name) )
+
+		for definition in deferred:
+			self.cur.execute("INSERT INTO bulk_loader_deferred (definition) VALUES (%s)", (definition,))
+		for drop in drops:
+			self.cur.execute(drop)
+
+		self.conn.commit()
+		return True
+
+	def _restore(self):
+		self.cur.execute("SELECT definition FROM bulk_loader_deferred ORDER BY position")
+		for definition, in self.cur.fetchall():
+			self.cur.execute(definition)
+		self.cur.execute("DELETE FROM bulk_loader_deferred")
+
+		self.conn.commit()
+
+	def restoreIndexes(self):
+		if not self.locked:
+			return
+
+		self._restore()
+
+		self.cur.execute("SELECT pg_advisory_unlock(hashtext(%s))", (deferLock,))
+		self.conn.commit()
+		self.locked = False
+
+	def close(self):
+		self.flush()
+		self.restoreIndexes()
+		self.cur.close()
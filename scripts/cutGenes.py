@@ -1,8 +1,11 @@
 import sys
-from Bio import SeqIO
+import multiprocessing
 from Bio.Seq import Seq
 import psycopg2
 
+from bulkLoader import BulkLoader
+from fastaIndex import FastaFile
+
 gffFile = open(sys.argv[1])
 
 dbName = sys.argv[5]
@@ -67,25 +70,18 @@ stopTarget = []
 
 gffFile.close()
 
-# Get transcript lengths
-
-transFile = open(sys.argv[2])
+# Get transcript lengths and index the scaffolds, both read from the
+# indexed files without loading the sequences
 
-transSeq = SeqIO.to_dict(SeqIO.parse(transFile, "fasta"))
+transSeq = FastaFile(sys.argv[2])
 
-for transcriptName, seq in transSeq.items():
+for transcriptName, length in transSeq.lengths().items():
 	if transcriptName in transcripts:
-		transcripts[transcriptName]["length"] = len(seq)
-
-transFile.close()
+		transcripts[transcriptName]["length"] = length
 
-# Loading scaffold sequences
+transSeq.close()
 
-scaffFile = open(sys.argv[3])
-
-scaffSeq = SeqIO.to_dict(SeqIO.parse(scaffFile, "fasta"))
-
-scaffFile.close()
+scaffSeq = FastaFile(sys.argv[3])
 
 
 # Loading cds locations
@@ -115,137 +111,145 @@ pepFile.close()
 
 # Putting all toogether
 
-loci = {}
+def cutLoci(scaffTranscripts):
+	# Cuts the loci of one scaffold and projects the CDSs of its transcripts
+	# onto them. Scaffolds are independent of each other, so they can be
+	# processed in parallel.
+	loci = {}
 
-for transcriptName, transcript in transcripts.items():
-	locusName 	= transcript["locusName"]
+	for transcriptName, transcript in scaffTranscripts:
+		locusName 	= transcript["locusName"]
 	
-	if not locusName in loci:
+		if not locusName in loci:
 
-		loci[locusName] = {}
+			loci[locusName] = {}
 
-		scaff    	= locusName.split(':')[0]
+			scaff    	= locusName.split(':')[0]
 
-		start = min( [ex[0] for ex in transcript["exons"]] )
-		stop  = max( [ex[1] for ex in transcript["exons"]] )
+			start = min( [ex[0] for ex in transcript["exons"]] )
+			stop  = max( [ex[1] for ex in transcript["exons"]] )
 
-		startCut 	= max(0, start-3000 ) + 1
-		stopCut 	= min(stop + 3000, len( scaffSeq[scaff].seq ) ) + 1
+			startCut 	= max(0, start-3000 ) + 1
+			stopCut 	= min(stop + 3000, len( scaffSeq[scaff] ) ) + 1
 
-		loci[locusName]["seq"] = str(scaffSeq[scaff].seq[startCut-1:stopCut]).upper()
-		loci[locusName]["coordinates"] = "{0}:{1}:{2}".format(locusName.split(':')[0], startCut, stopCut)
-		loci[locusName]["startCut"] = startCut
-		loci[locusName]["stopCut"] = stopCut
+			loci[locusName]["seq"] = scaffSeq[scaff][startCut-1:stopCut].upper()
+			loci[locusName]["coordinates"] = "{0}:{1}:{2}".format(locusName.split(':')[0], startCut, stopCut)
+			loci[locusName]["startCut"] = startCut
+			loci[locusName]["stopCut"] = stopCut
 
 
-	startCut = loci[locusName]["startCut"]
-	stopCut = loci[locusName]["stopCut"]
+		startCut = loci[locusName]["startCut"]
+		stopCut = loci[locusName]["stopCut"]
 
-	for i in range( len(transcript["exons"]) ):
-			exon = transcript["exons"][i]
-			transcript["exons"][i] = (exon[0] - startCut + 1, exon[1] - startCut + 1 )
+		for i in range( len(transcript["exons"]) ):
+				exon = transcript["exons"][i]
+				transcript["exons"][i] = (exon[0] - startCut + 1, exon[1] - startCut + 1 )
 	
-	for cdsName, cds in transcript["cdss"].items():
-			cdsDir = cds["transLoc"][2]
+		for cdsName, cds in transcript["cdss"].items():
+				cdsDir = cds["transLoc"][2]
 
-			started = False 
+				started = False 
 				
-			if cdsDir == '+':
-				cdsStart 	=  cds["transLoc"][0]
-				cdsStop  	=  cds["transLoc"][1]
-				cPos 		=  transcript["start"] - 1
-			else:
-				cdsStart 	= transcript["length"] - cds["transLoc"][1] + 1
-				cdsStop  	= transcript["length"] - cds["transLoc"][0] + 1
-				cPos 	 	= transcript["length"] - transcript["stop"]
+				if cdsDir == '+':
+					cdsStart 	=  cds["transLoc"][0]
+					cdsStop  	=  cds["transLoc"][1]
+					cPos 		=  transcript["start"] - 1
+				else:
+					cdsStart 	= transcript["length"] - cds["transLoc"][1] + 1
+					cdsStop  	= transcript["length"] - cds["transLoc"][0] + 1
+					cPos 	 	= transcript["length"] - transcript["stop"]
 
-			if cPos < cdsStart:
+				if cPos < cdsStart:
 
-				if cdsDir == transcript["direction"]:
-					transcript["exons"].sort(key = lambda x: x[0])
+					if cdsDir == transcript["direction"]:
+						transcript["exons"].sort(key = lambda x: x[0])
 
-					for exon in transcript["exons"]:
-						exonStart = exon[0]
-						exonStop  = exon[1]
+						for exon in transcript["exons"]:
+							exonStart = exon[0]
+							exonStop  = exon[1]
 				
-						exonL = exonStop - exonStart + 1
-						cPos += exonL
-
-						if (not started):
-							if (cPos >= cdsStart):
+							exonL = exonStop - exonStart + 1
+							cPos += exonL
+
+							if (not started):
+								if (cPos >= cdsStart):
+									if (cPos < cdsStop):
+										cds["geneLoc"].append( ( exonStop - (cPos - cdsStart), exonStop ) )
+										started = True
+									else:
+										cds["geneLoc"].append( ( exonStop - (cPos - cdsStart), exonStop - (cPos - cdsStop) ) )
+										break
+							else:
 								if (cPos < cdsStop):
-									cds["geneLoc"].append( ( exonStop - (cPos - cdsStart), exonStop ) )
-									started = True
+									cds["geneLoc"].append( ( exonStart, exonStop ) )
 								else:
-									cds["geneLoc"].append( ( exonStop - (cPos - cdsStart), exonStop - (cPos - cdsStop) ) )
+									cds["geneLoc"].append( ( exonStart, exonStop - (cPos - cdsStop) ) )
 									break
-						else:
-							if (cPos < cdsStop):
-								cds["geneLoc"].append( ( exonStart, exonStop ) )
-							else:
-								cds["geneLoc"].append( ( exonStart, exonStop - (cPos - cdsStop) ) )
-								break
-				else:
-					transcript["exons"].sort(key = lambda x: x[0], reverse = True)
+					else:
+						transcript["exons"].sort(key = lambda x: x[0], reverse = True)
 
-					for exon in transcript["exons"]:
-						exonStart = exon[0]
-						exonStop  = exon[1]
+						for exon in transcript["exons"]:
+							exonStart = exon[0]
+							exonStop  = exon[1]
 				
-						exonL = exonStop - exonStart + 1
-						cPos += exonL
-
-						if (not started):
-							if (cPos >= cdsStart):
+							exonL = exonStop - exonStart + 1
+							cPos += exonL
+
+							if (not started):
+								if (cPos >= cdsStart):
+									if (cPos < cdsStop):
+										cds["geneLoc"].append( ( exonStart, exonStart + (cPos - cdsStart) ) )
+										started = True
+									else:
+										cds["geneLoc"].append( ( exonStart + (cPos - cdsStop), exonStart + (cPos - cdsStart) ) )
+										break
+							else:
 								if (cPos < cdsStop):
-									cds["geneLoc"].append( ( exonStart, exonStart + (cPos - cdsStart) ) )
-									started = True
+									cds["geneLoc"].append( ( exonStart, exonStop ) )
 								else:
-									cds["geneLoc"].append( ( exonStart + (cPos - cdsStop), exonStart + (cPos - cdsStart) ) )
+									cds["geneLoc"].append( ( exonStart + (cPos - cdsStop), exonStop ) )
 									break
-						else:
-							if (cPos < cdsStop):
-								cds["geneLoc"].append( ( exonStart, exonStop ) )
-							else:
-								cds["geneLoc"].append( ( exonStart + (cPos - cdsStop), exonStop ) )
-								break
 
-conn = psycopg2.connect("dbname={0}".format(dbName))
-cur = conn.cursor()
+	return loci, scaffTranscripts
 
-commonPrefix = 'mpdb'
+# Transcripts are grouped by scaffold and the scaffolds are merged back in
+# sorted order, so the IDs do not depend on the number of processes
 
-def newID(table):
-	cur.execute("SELECT COUNT(*) FROM {0}".format(table), )
-	nid = cur.fetchone()[0]
-	if nid is not None:
-		nid = "{0}.{1}.{2}".format(commonPrefix, table, int(nid) )
-		return nid
-	else:
-		return None
+numProcesses = int(sys.argv[6]) if len(sys.argv) > 6 else 1
 
+scaffolds = {}
+for transcriptName, transcript in transcripts.items():
+	scaffolds.setdefault( transcript["locusName"].split(':')[0], [] ).append( (transcriptName, transcript) )
 
-def insertRow(table, valuesDict):
-	nid = newID(table)
+jobs = [ scaffolds[scaff] for scaff in sorted(scaffolds) ]
 
-	if nid:
-		valuesDict['id'] = nid
-		keys = tuple( valuesDict.keys() )
-		values = tuple( [ valuesDict[key] for key in keys ] )
-		
-		keyString = ','.join(keys)
+if numProcesses > 1:
+	# Forked workers share the memory-mapped genome
+	pool = multiprocessing.get_context('fork').Pool(numProcesses)
+	results = pool.imap(cutLoci, jobs)
+else:
+	pool = None
+	results = map(cutLoci, jobs)
 
-		exeString = "INSERT INTO {0} ({1}) VALUES %s RETURNING id".format(table, keyString)
-		cur.execute(exeString, (values,))
-		
+loci = {}
+transcripts = {}
 
-		cid = cur.fetchone()[0]
+for scaffLoci, scaffTranscripts in results:
+	loci.update(scaffLoci)
+	transcripts.update(scaffTranscripts)
 
-		if cid:
-			conn.commit()
-			return cid
+if pool:
+	pool.close()
+	pool.join()
 
-	return None
+conn = psycopg2.connect("dbname={0}".format(dbName))
+
+commonPrefix = 'mpdb'
+
+loader = BulkLoader(conn, commonPrefix)
+loader.deferIndexes(['locus', 'cds', 'promoter', 'terminator', 'utr5', 'utr3', 'gene'])
+
+insertRow = loader.insertRow
 
 def compRev(seq, sign):
 	if sign =='-':
@@ -286,80 +290,89 @@ def getUtrCoordinates(exons, cdsStart, cdsStop):
 
 	return coordinates
 
-for locusName, locus in loci.items():
-	locus["PromoterP"] = None
-	locus["PromoterN"] = None
-	locus["TerminatorP"] = None
-	locus["TerminatorN"] = None
-	locus["ID"] = insertRow('locus', {'coordinates' : locus["coordinates"]})
+# The deferred indexes come back even when the load fails
+try:
+	for locusName, locus in loci.items():
+		locus["PromoterP"] = None
+		locus["PromoterN"] = None
+		locus["TerminatorP"] = None
+		locus["TerminatorN"] = None
+		locus["ID"] = insertRow('locus', {'coordinates' : locus["coordinates"]})
 
-for transcriptName, transcript in transcripts.items():
+	for transcriptName, transcript in transcripts.items():
 
-	locus = loci[ transcript["locusName"] ]
+		locus = loci[ transcript["locusName"] ]
 
-	transStart = min ( [ex[0] for ex in transcript["exons"]] )
-	transStop =  max ( [ex[1] for ex in transcript["exons"]] )
+		transStart = min ( [ex[0] for ex in transcript["exons"]] )
+		transStop =  max ( [ex[1] for ex in transcript["exons"]] )
 
-	for cdsName, cds in transcript["cdss"].items():
-		if transcript["direction"] == cds["transLoc"][2]:
-			direction = '+'
-		else:
-			direction = '-'
-
-		coordinates = ';'.join(str(cds[0]) + ',' + str(cds[1]) + ',' + direction for cds in cds["geneLoc"])
+		for cdsName, cds in transcript["cdss"].items():
+			if transcript["direction"] == cds["transLoc"][2]:
+				direction = '+'
+			else:
+				direction = '-'
 
-		cdsStart = min( [ex[0] for ex in  cds["geneLoc"]] )
-		cdsStop  = max( [ex[1] for ex in  cds["geneLoc"]] )
+			coordinates = ';'.join(str(cds[0]) + ',' + str(cds[1]) + ',' + direction for cds in cds["geneLoc"])
 
+			cdsStart = min( [ex[0] for ex in  cds["geneLoc"]] )
+			cdsStop  = max( [ex[1] for ex in  cds["geneLoc"]] )
 
-		sequence = compRev(locus["seq"][cdsStart-1:cdsStop], direction)
 
-		cdsID = insertRow('cds', {'coordinates' : coordinates, 'seq' : sequence})
+			sequence = compRev(locus["seq"][cdsStart-1:cdsStop], direction)
 
+			cdsID = insertRow('cds', {'coordinates' : coordinates, 'seq' : sequence})
 
-		if direction == '+':
-			if not locus["PromoterP"]:
-				sequence = compRev(locus["seq"][:transStart-1], direction)
-				promoterID = insertRow('promoter', {'seq' : sequence})
 
-				sequence = compRev(locus["seq"][transStop-1:], direction)
-				terminatorID = insertRow('terminator', {'seq' : sequence})
-				locus["PromoterP"] = promoterID
-				locus["TerminatorP"] = terminatorID
-			else:
-				promoterID = locus["PromoterP"]
-				terminatorID = locus["TerminatorP"]
+			if direction == '+':
+				if not locus["PromoterP"]:
+					sequence = compRev(locus["seq"][:transStart-1], direction)
+					promoterID = insertRow('promoter', {'seq' : sequence})
+
+					sequence = compRev(locus["seq"][transStop-1:], direction)
+					terminatorID = insertRow('terminator', {'seq' : sequence})
+					locus["PromoterP"] = promoterID
+					locus["TerminatorP"] = terminatorID
+				else:
+					promoterID = locus["PromoterP"]
+					terminatorID = locus["TerminatorP"]
 		
-		if direction == '-':
-			if not locus["PromoterN"]:
-				sequence = compRev(locus["seq"][transStop-1:], direction)
-				promoterID = insertRow('promoter', {'seq' : sequence})
-
-				sequence = compRev(locus["seq"][:transStart-1], direction)
-				terminatorID = insertRow('terminator', {'seq' : sequence})
-				locus["PromoterN"] = promoterID
-				locus["TerminatorN"] = terminatorID
-			else:
-				promoterID = locus["PromoterN"]
-				terminatorID = locus["TerminatorN"]
+			if direction == '-':
+				if not locus["PromoterN"]:
+					sequence = compRev(locus["seq"][transStop-1:], direction)
+					promoterID = insertRow('promoter', {'seq' : sequence})
+
+					sequence = compRev(locus["seq"][:transStart-1], direction)
+					terminatorID = insertRow('terminator', {'seq' : sequence})
+					locus["PromoterN"] = promoterID
+					locus["TerminatorN"] = terminatorID
+				else:
+					promoterID = locus["PromoterN"]
+					terminatorID = locus["TerminatorN"]
 
-		utrLD = {'+':'utr5', '-':'utr3'}
-		utrRD = {'+':'utr3', '-':'utr5'}
+			utrLD = {'+':'utr5', '-':'utr3'}
+			utrRD = {'+':'utr3', '-':'utr5'}
 
-		sequence = compRev(locus["seq"][transStart-1:cdsStart], direction)
-		coordinates = getUtrCoordinates(cds["geneLoc"], cdsStart, cdsStop)
+			sequence = compRev(locus["seq"][transStart-1:cdsStart], direction)
+			coordinates = getUtrCoordinates(cds["geneLoc"], cdsStart, cdsStop)
 
-		utrL = insertRow(utrLD[direction] , {'seq': sequence, 'coordinates': coordinates})
+			utrL = insertRow(utrLD[direction] , {'seq': sequence, 'coordinates': coordinates})
 
-		sequence = compRev(locus["seq"][cdsStop-1:transStop], direction)
-		coordinates = getUtrCoordinates(cds["geneLoc"], cdsStart, cdsStop)
+			sequence = compRev(locus["seq"][cdsStop-1:transStop], direction)
+			coordinates = getUtrCoordinates(cds["geneLoc"], cdsStart, cdsStop)
 
-		utrR = insertRow(utrRD[direction], {'seq': sequence, 'coordinates': coordinates})
+			utrR = insertRow(utrRD[direction], {'seq': sequence, 'coordinates': coordinates})
 
-		geneID = insertRow('gene', {'promoter_id' : promoterID, '{0}_id'.format( utrLD[direction] ) : utrL, '{0}_id'.format( utrRD[direction] ) : utrR, 'cds_id' : cdsID, 'terminator_id' : terminatorID, "locus_id" : locus["ID"]  })
+			geneID = insertRow('gene', {'promoter_id' : promoterID, '{0}_id'.format( utrLD[direction] ) : utrL, '{0}_id'.format( utrRD[direction] ) : utrR, 'cds_id' : cdsID, 'terminator_id' : terminatorID, "locus_id" : locus["ID"]  })
+
+			if geneID:
+				if direction == '+':
+					print('\t'.join([cdsID, geneID, promoterID, utrL, cdsID, utrR, terminatorID, locus["ID"], "{0}|{1}".format(transcriptName, cdsName) ]))
+				else:
+					print('\t'.join([cdsID, geneID, promoterID, utrR, cdsID, utrL, terminatorID, locus["ID"], "{0}|{1}".format(transcriptName, cdsName) ]))
+
+	loader.close()
+finally:
+	conn.rollback()
+	loader.restoreIndexes()
+	conn.close()
 
-		if geneID:
-			if direction == '+':
-				print('\t'.join([cdsID, geneID, promoterID, utrL, cdsID, utrR, terminatorID, locus["ID"], "{0}|{1}".format(transcriptName, cdsName) ]))
-			else:
-				print('\t'.join([cdsID, geneID, promoterID, utrR, cdsID, utrL, terminatorID, locus["ID"], "{0}|{1}".format(transcriptName, cdsName) ]))
@@ -0,0 +1,109 @@
+import os
+import mmap
+
+# Random access to large FASTA files through a samtools-compatible .fai index
+# and a memory-mapped file, so that slices of a scaffold are read without
+# loading the scaffold or the rest of the file.
+
+def buildFaidx(fastaFileName, indexFileName = None):
+	# Writes name, length, offset, bases per line and bytes per line of every
+	# record, the columns of samtools faidx
+	indexFileName = indexFileName or fastaFileName + '.fai'
+	entries = []
+	entry = None
+	offset = 0
+	lastLine = False
+
+	with open(fastaFileName, 'rb') as fastaFile:
+		for line in fastaFile:
+			if line.startswith(b'>'):
+				entry = [line[1:].split()[0].decode('ascii'), 0, offset + len(line), 0, 0]
+				entries.append(entry)
+				lastLine = False
+			elif entry is not None:
+				bases = len(line.rstrip(b'\r\n'))
+				if bases:
+					if lastLine:
+						raise ValueError("Lines of {0} in {1} have different lengths".format(entry[0], fastaFileName))
+					if not entry[3]:
+						entry[3], entry[4] = bases, len(line)
+					elif bases != entry[3] or len(line) != entry[4]:
+						lastLine = True
+					entry[1] += bases
+			offset += len(line)
+
+	with open(indexFileName + '.tmp', 'w') as indexFile:
+		for entry in entries:
+			indexFile.write( '\t'.join( str(value) for value in entry ) + '\n' )
+	os.replace(indexFileName + '.tmp', indexFileName)
+
+	return indexFileName
+
+class FastaRecord(object):
+
+	def __init__(self, fasta, name, length, offset, lineBases, lineWidth):
+		self.fasta = fasta
+		self.name = name
+		self.length = length
+		self.offset = offset
+		self.lineBases = lineBases
+		self.lineWidth = lineWidth
+
+	def __len__(self):
+		return self.length
+
+	def _position(self, base):
+		return self.offset + (base // self.lineBases) * self.lineWidth + base % self.lineBases
+
+	def __getitem__(self, key):
+		if not isinstance(key, slice) or key.step not in (None, 1):
+			raise TypeError("Only contiguous slices of FASTA records are supported")
+
+		start, stop, step = key.indices(self.length)
+		if stop <= start:
+			return ''
+
+		data = self.fasta.data[ self._position(start) : self._position(stop - 1) + 1 ]
+		return data.replace(b'\n', b'').replace(b'\r', b'').decode('ascii')
+
+	def __str__(self):
+		return self[:]
+
+class FastaFile(object):
+	# Read-only, dict-like view of a FASTA file. The index is built on first
+	# use and rebuilt when the FASTA file is newer.
+
+	def __init__(self, fileName):
+		self.fileName = fileName
+		indexFileName = fileName + '.fai'
+
+		if not os.path.isfile(indexFileName) or os.path.getmtime(indexFileName) < os.path.getmtime(fileName):
+			buildFaidx(fileName, indexFileName)
+
+		self.index = {}
+		with open(indexFileName) as indexFile:
+			for line in indexFile:
+				name, length, offset, lineBases, lineWidth = line.rstrip('\n').split('\t')[:5]
+				self.index[name] = (int(length), int(offset), int(lineBases), int(lineWidth))
+
+		self.file = open(fileName, 'rb')
+		self.data = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ)
+
+	def __contains__(self, name):
+		return name in self.index
+
+	def __getitem__(self, name):
+		return FastaRecord(self, name, *self.index[name])
+
+	def __iter__(self):
+		return iter(self.index)
+
+	def __len__(self):
+		return len(self.index)
+
+	def lengths(self):
+		return { name: entry[0] for name, entry in self.index.items() }
+
+	def close(self):
+		self.data.close()
+		self.file.close()
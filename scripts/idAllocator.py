@@ -0,0 +1,50 @@
+from collections import deque
+
+# IDs of the form <prefix>.<table>.<n>, with n taken from a PostgreSQL
+# sequence per table. Numbers are fetched a block at a time, so minting an
+# ID rarely needs a round trip, and concurrent loaders never get the same
+# number.
+
+class IDAllocator(object):
+
+	def __init__(self, conn, prefix = 'mpdb', blockSize = 1000):
+		self.conn = conn
+		self.cur = conn.cursor()
+		self.prefix = prefix
+		self.blockSize = blockSize
+		self.blocks = {}
+
+	def sequenceName(self, table):
+		return "{0}_{1}_id_seq".format(table, self.prefix)
+
+	def _createSequence(self, table):
+		# The first loader creates the sequence, starting after the highest
+		# number already used in the table. The advisory lock keeps loaders
+		# starting at the same time from racing.
+		sequence = self.sequenceName(table)
+
+		self.cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (sequence,))
+		self.cur.execute("SELECT to_regclass(%s)", (sequence,))
+
+		if self.cur.fetchone()[0] is None:
+			self.cur.execute("SELECT MAX( CAST(substring(id from '\\.([0-9]+)$') AS bigint) ) FROM {0} WHERE id LIKE %s".format(table), (self.prefix + '.' + table + '.%',))
+			last = self.cur.fetchone()[0]
+
+			self.cur.execute("CREATE SEQUENCE {0} MINVALUE 0 START 0".format(sequence))
+			self.cur.execute("SELECT setval(%s, %s, false)", (sequence, 0 if last is None else last + 1))
+
+		self.conn.commit()
+
+	def _fetchBlock(self, table):
+		if not table in self.blocks:
+			self._createSequence(table)
+			self.blocks[table] = deque()
+
+		self.cur.execute("SELECT nextval(%s) FROM generate_series(1, %s)", (self.sequenceName(table), self.blockSize))
+		self.blocks[table].extend( row[0] for row in self.cur.fetchall() )
+
+	def newID(self, table):
+		if not self.blocks.get(table):
+			self._fetchBlock(table)
+
+		return "{0}.{1}.{2}".format(self.prefix, table, self.blocks[table].popleft())
@@ -2,6 +2,8 @@
 import sys
 import psycopg2
 
+from idAllocator import IDAllocator
+
 inFile = open(sys.argv[1])
 
 dbName = sys.argv[2]
@@ -13,14 +15,10 @@ hits = {}
 
 commonPrefix = "mpdb"
 
+ids = IDAllocator(conn, commonPrefix)
+
 def newID(table):
-	cur.execute("SELECT COUNT(*) FROM {0}".format(table), )
-	nid = cur.fetchone()[0]
-	if nid is not None:
-		nid = "{0}.{1}.{2}".format(commonPrefix, table, int(nid) )
-		return nid
-	else:
-		return None
+	return ids.newID(table)
 
 def insertRow(table, valuesDict):
 	nid = newID(table)
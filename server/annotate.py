@@ -1,8 +1,18 @@
 import sys
 from partsdb.partsdb import PartsDB
 from .tables import *
+from .cache import bumpDataVersion
+from .system import refreshSearchDocuments, refreshBestHomologs, refreshBlastpHSPs, packCoordinates, createSearchIndexes
 
 marpodb = PartsDB('postgresql:///'+sys.argv[1], Base = Base)
 
 marpodb.annotate('blastphit', fileName = 'data/filtered/blastp.info')
 marpodb.annotate('pfamhit', fileName = 'data/filtered/Pfam.domtblout')
+
+refreshSearchDocuments(marpodb.engine)
+refreshBestHomologs(marpodb.engine)
+refreshBlastpHSPs(marpodb.engine)
+packCoordinates(marpodb.engine)
+createSearchIndexes(marpodb.engine)
+
+bumpDataVersion()
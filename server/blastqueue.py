@@ -0,0 +1,240 @@
+import os
+import re
+import glob
+import json
+import time
+import uuid
+import fcntl
+import shutil
+import hashlib
+import subprocess
+
+from concurrent.futures import ThreadPoolExecutor
+
+# Programs exactly as the BLAST form offers them, with their fixed options
+blastPrograms = ['blastn', 'blastn -task blastn', 'blastn -task megablast', 'blastp', 'blastx', 'tblastn', 'tblastx']
+jobPattern = re.compile(r'^[0-9a-f]{32}$')
+
+def blastDatabase(program):
+	if (program.startswith('blastn') or program == 'tblastx'):
+		return 'blast/MarpoDB_Genes', 'Gene'
+	else:
+		return 'blast/MarpoDB_Proteins', 'CDS'
+
+def blastCommand(program, evalue, matrix, perc, numThreads = 1, numAlignments = 10):
+	if not program in blastPrograms:
+		raise ValueError("Unknown BLAST program {0}".format(program))
+
+	route, idType = blastDatabase(program)
+
+	command = program.split() + ['-db', route, '-evalue', evalue, '-num_alignments', str(numAlignments), '-num_threads', str(numThreads), '-outfmt', '15']
+
+	if (program.startswith('blastn') ):
+		command += ['-perc_identity' , perc]
+	else:
+		command += ['-matrix', matrix]
+
+	return command
+
+def normalizeFasta(query):
+	# Record names and line wrapping do not change the search, only the
+	# sequences and their order do
+	records = []
+	for line in query.splitlines():
+		line = line.strip()
+		if line.startswith('>'):
+			records.append('')
+		elif line:
+			if not records:
+				records.append('')
+			records[-1] += ''.join(line.split()).upper()
+
+	return '>'.join(records)
+
+def blastDatabaseStamp(route):
+	# Name, size and modification time of every file of the BLAST database,
+	# so that rebuilding the database changes the stamp
+	stamp = []
+	for fileName in sorted( glob.glob(route + '.*') ):
+		info = os.stat(fileName)
+		stamp.append( "{0}:{1}:{2}".format(os.path.basename(fileName), info.st_size, int(info.st_mtime)) )
+
+	return ';'.join(stamp)
+
+def blastCacheKey(query, program, evalue, matrix, perc, numAlignments = 10):
+	route, idType = blastDatabase(program)
+
+	if (program.startswith('blastn') ):
+		matrix = ''
+	else:
+		perc = ''
+
+	key = '\n'.join([ normalizeFasta(query), ' '.join(program.split()), evalue, matrix, perc, str(numAlignments), blastDatabaseStamp(route) ])
+	return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+def processAlive(pid):
+	try:
+		os.kill(pid, 0)
+	except ProcessLookupError:
+		return False
+	except PermissionError:
+		pass
+	return True
+
+class BlastQueue(object):
+	# BLAST searches run outside of the web request. Job state lives in
+	# jobDir, which lets any server process answer status requests. A job
+	# only starts BLAST while holding one of the maxJobs slot locks in
+	# jobDir, so maxJobs caps the concurrent alignments of all server
+	# processes together. Jobs whose server process died or that outlast
+	# jobTimeout are reported as failed, and jobs older than maxAge are
+	# removed.
+
+	def __init__(self, jobDir = 'data/blast_jobs', maxJobs = 2, numThreads = 1, numAlignments = 10, jobTimeout = 3600, maxAge = 86400):
+		self.jobDir = jobDir
+		self.maxJobs = maxJobs
+		self.numThreads = numThreads
+		self.numAlignments = numAlignments
+		self.jobTimeout = jobTimeout
+		self.maxAge = maxAge
+		self.executor = ThreadPoolExecutor(max_workers = maxJobs)
+		self.futures = {}
+		self.lastCleanup = 0
+
+		self.slotDir = os.path.join(jobDir, 'slots')
+		if not os.path.isdir(self.slotDir):
+			os.makedirs(self.slotDir)
+
+	def _path(self, jobID, name):
+		if not jobPattern.match(jobID or ''):
+			raise ValueError("Invalid BLAST job {0}".format(jobID))
+		return os.path.join(self.jobDir, jobID, name)
+
+	def _acquireSlot(self, deadline):
+		# Tries the slot lock files in turn until one is free. flock locks
+		# are released by the kernel if the process dies.
+		while True:
+			for slot in range(self.maxJobs):
+				slotFile = open(os.path.join(self.slotDir, str(slot)), 'a')
+				try:
+					fcntl.flock(slotFile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+					return slotFile
+				except (IOError, OSError):
+					slotFile.close()
+
+			if time.time() > deadline:
+				return None
+			time.sleep(0.5)
+
+	def cleanup(self, maxAge = None):
+		# Removes the jobs submitted more than maxAge seconds ago
+		maxAge = self.maxAge if maxAge is None else maxAge
+		cutoff = time.time() - maxAge
+
+		for jobID in os.listdir(self.jobDir):
+			if not jobPattern.match(jobID) or jobID in self.futures:
+				continue
+			try:
+				if os.path.getmtime(self._path(jobID, 'params.json')) < cutoff:
+					shutil.rmtree( os.path.join(self.jobDir, jobID), ignore_errors = True )
+			except OSError:
+				continue
+
+		self.lastCleanup = time.time()
+
+	def submit(self, query, program, evalue, matrix, perc, cacheKey = None):
+		if not program in blastPrograms:
+			raise ValueError("Unknown BLAST program {0}".format(program))
+
+		if time.time() - self.lastCleanup > 600:
+			self.cleanup()
+
+		jobID = uuid.uuid4().hex
+		os.makedirs( os.path.join(self.jobDir, jobID) )
+
+		params = {'program': program, 'evalue': evalue, 'matrix': matrix, 'perc': perc, 'cacheKey': cacheKey, 'submitted': time.time(), 'pid': os.getpid()}
+		with open(self._path(jobID, 'params.json'), 'w') as paramsFile:
+			json.dump(params, paramsFile)
+
+		self.futures[jobID] = self.executor.submit(self._run, jobID, query, program, evalue, matrix, perc)
+		return jobID
+
+	def _fail(self, jobID, message):
+		with open(self._path(jobID, 'error'), 'wb') as errorFile:
+			errorFile.write(message)
+
+	def _run(self, jobID, query, program, evalue, matrix, perc):
+		command = blastCommand(program, evalue, matrix, perc, self.numThreads, self.numAlignments)
+		deadline = self.params(jobID)['submitted'] + self.jobTimeout
+
+		try:
+			slotFile = self._acquireSlot(deadline)
+			if slotFile is None:
+				self._fail(jobID, b'Timed out waiting for a BLAST slot')
+				return
+
+			try:
+				cmd = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+				try:
+					out, error = cmd.communicate(query.encode('utf-8'), timeout = max(deadline - time.time(), 1))
+				except subprocess.TimeoutExpired:
+					cmd.kill()
+					cmd.communicate()
+					out, error = None, b'BLAST timed out'
+			except OSError as e:
+				out, error = None, str(e).encode('utf-8')
+			finally:
+				slotFile.close()
+
+			if out:
+				path = self._path(jobID, 'result.json')
+				with open(path + '.tmp', 'wb') as resultFile:
+					resultFile.write(out)
+				os.replace(path + '.tmp', path)
+			else:
+				self._fail(jobID, error or b'No output')
+		finally:
+			self.futures.pop(jobID, None)
+
+	def params(self, jobID):
+		try:
+			with open(self._path(jobID, 'params.json')) as paramsFile:
+				return json.load(paramsFile)
+		except (IOError, ValueError):
+			return None
+
+	def _lost(self, jobID):
+		# A job no server process will finish, because the process that owns
+		# it died or it ran past the timeout
+		if jobID in self.futures:
+			return False
+
+		params = self.params(jobID)
+		if params is None:
+			return False
+
+		if params.get('pid') and not processAlive(params['pid']):
+			return True
+		return time.time() - params['submitted'] > self.jobTimeout + 60
+
+	def status(self, jobID):
+		if not jobPattern.match(jobID or '') or not os.path.isfile(self._path(jobID, 'params.json')):
+			return 'unknown'
+
+		if os.path.isfile(self._path(jobID, 'result.json')):
+			return 'done'
+		if os.path.isfile(self._path(jobID, 'error')):
+			return 'failed'
+		if self._lost(jobID):
+			self._fail(jobID, b'BLAST job was lost')
+			return 'failed'
+
+		return 'running'
+
+	def result(self, jobID):
+		# The report as a text file object, for reading it in chunks
+		return open(self._path(jobID, 'result.json'), encoding = 'utf-8')
+
+	def error(self, jobID):
+		with open(self._path(jobID, 'error'), 'rb') as errorFile:
+			return errorFile.read().decode('utf-8', 'replace')
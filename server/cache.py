@@ -0,0 +1,195 @@
+import os
+import time
+import pickle
+import hashlib
+import tempfile
+import threading
+
+from collections import OrderedDict
+
+dataVersionFileName = 'data/version'
+
+def dataVersion(fileName = dataVersionFileName):
+	try:
+		with open(fileName) as versionFile:
+			return versionFile.read().strip()
+	except IOError:
+		return ''
+
+def bumpDataVersion(fileName = dataVersionFileName):
+	version = "{0:.6f}".format(time.time())
+
+	directory = os.path.dirname(fileName)
+	if directory and not os.path.isdir(directory):
+		os.makedirs(directory)
+
+	with open(fileName, 'w') as versionFile:
+		versionFile.write(version)
+
+	return version
+
+class LRUCache(object):
+
+	def __init__(self, maxSize = 256):
+		self.maxSize = maxSize
+		self.entries = OrderedDict()
+		self.lock = threading.Lock()
+
+	def get(self, key):
+		with self.lock:
+			if not key in self.entries:
+				return None
+			value = self.entries.pop(key)
+			self.entries[key] = value
+			return value
+
+	def set(self, key, value):
+		with self.lock:
+			self.entries.pop(key, None)
+			self.entries[key] = value
+			while len(self.entries) > self.maxSize:
+				self.entries.popitem(last = False)
+
+	def delete(self, key):
+		with self.lock:
+			self.entries.pop(key, None)
+
+	def clear(self):
+		with self.lock:
+			self.entries.clear()
+
+	def __len__(self):
+		return len(self.entries)
+
+class DiskCache(object):
+	# Pickled entries in a shared directory, so that several server workers
+	# see each other's results. Access time is tracked with the file mtime.
+
+	def __init__(self, directory, maxSize = 4096):
+		self.directory = directory
+		self.maxSize = maxSize
+
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+
+	def _path(self, key):
+		return os.path.join( self.directory, hashlib.sha1(repr(key).encode('utf-8')).hexdigest() )
+
+	def get(self, key):
+		path = self._path(key)
+		try:
+			with open(path, 'rb') as entryFile:
+				storedKey, value = pickle.load(entryFile)
+			os.utime(path, None)
+		except (IOError, OSError, EOFError, pickle.UnpicklingError):
+			return None
+
+		if storedKey != key:
+			return None
+		return value
+
+	def set(self, key, value):
+		fd, tempPath = tempfile.mkstemp(dir = self.directory, suffix = '.tmp')
+		with os.fdopen(fd, 'wb') as entryFile:
+			pickle.dump( (key, value), entryFile, pickle.HIGHEST_PROTOCOL )
+		os.replace(tempPath, self._path(key))
+
+		self._evict()
+
+	def delete(self, key):
+		try:
+			os.remove(self._path(key))
+		except OSError:
+			pass
+
+	def clear(self):
+		for path in self._entries():
+			try:
+				os.remove(path)
+			except OSError:
+				pass
+
+	def _entries(self):
+		return [ os.path.join(self.directory, name) for name in os.listdir(self.directory) if not name.endswith('.tmp') ]
+
+	def _evict(self):
+		entries = self._entries()
+		if len(entries) <= self.maxSize:
+			return
+
+		mtimes = []
+		for path in entries:
+			try:
+				mtimes.append( (os.path.getmtime(path), path) )
+			except OSError:
+				pass
+
+		mtimes.sort()
+		for mtime, path in mtimes[:len(mtimes) - self.maxSize]:
+			try:
+				os.remove(path)
+			except OSError:
+				pass
+
+	def __len__(self):
+		return len(self._entries())
+
+class ResultCache(object):
+	# Wraps a backend, prefixing every key with the current data version so
+	# that reloading the database invalidates all entries at once. With a ttl
+	# (in seconds) entries also expire on their own.
+
+	def __init__(self, backend, versionFileName = dataVersionFileName, ttl = None):
+		self.backend = backend
+		self.versionFileName = versionFileName
+		self.ttl = ttl
+		self.version = None
+		self.hits = 0
+		self.misses = 0
+
+	def _key(self, key):
+		version = dataVersion(self.versionFileName)
+		if version != self.version:
+			if self.version is not None and isinstance(self.backend, LRUCache):
+				self.backend.clear()
+			self.version = version
+		return (version, key)
+
+	def get(self, key):
+		entry = self.backend.get( self._key(key) )
+
+		if entry is not None and self.ttl is not None and time.time() - entry[0] > self.ttl:
+			entry = None
+
+		if entry is None:
+			self.misses += 1
+			return None
+
+		self.hits += 1
+		return entry[1]
+
+	def set(self, key, value):
+		self.backend.set( self._key(key), (time.time(), value) )
+
+	def delete(self, key):
+		self.backend.delete( self._key(key) )
+
+	def stats(self):
+		return {'backend' : type(self.backend).__name__, 'size' : len(self.backend), 'hits' : self.hits, 'misses' : self.misses, 'version' : self.version}
+
+def createCache(name, maxSize = 256, ttl = None, localTTL = None):
+	# MARPODB_CACHE_DIR selects the shared on-disk backend, otherwise the
+	# cache lives in the memory of each server process. localTTL bounds the
+	# age of entries of the in-memory backend, for data that one process
+	# changes and the others would keep serving from their own copy.
+	cacheDir = os.environ.get("MARPODB_CACHE_DIR", '')
+	maxSize = int( os.environ.get("MARPODB_CACHE_SIZE", maxSize) )
+
+	if cacheDir:
+		backend = DiskCache( os.path.join(cacheDir, name), maxSize )
+	else:
+		backend = LRUCache(maxSize)
+		if localTTL is not None:
+			ttl = localTTL if ttl is None else min(ttl, localTTL)
+
+	return ResultCache(backend, ttl = ttl)
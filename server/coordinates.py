@@ -0,0 +1,101 @@
+import re
+import sys
+import array
+
+from Bio.SeqFeature import FeatureLocation, CompoundLocation
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+# Coordinates are packed as little-endian int32 triples (start, end, strand),
+# with 0-based, end-exclusive starts like Biopython's FeatureLocation and a
+# strand of 1, -1 or 0 when unknown.
+#
+# Text coordinates come in the formats written by the loaders:
+#  - partsdb parts, "start,end,strand;..." with 0-based starts and 1 or -1
+#  - scripts/cutGenes.py parts, "start,end,+;..." with 1-based starts
+#  - Pfam domains and UTRs of cutGenes.py, "start,end;..." with 1-based starts
+#  - loci, "scaffold:start-end" from partsdb (0-based) or
+#    "scaffold:start:end" from cutGenes.py (1-based)
+
+strandCodes = {'+': 1, '-': -1}
+locusPattern = re.compile(r'^(.*):(\d+)([-:])(\d+)$')
+
+def parseCoordinates(coordinates):
+	intervals = []
+
+	for record in (coordinates or '').split(';'):
+		fields = [ field.strip() for field in record.split(',') ]
+		if len(fields) < 2 or not fields[0]:
+			continue
+
+		start, end = int(fields[0]), int(fields[1])
+
+		if len(fields) > 2 and fields[2] in strandCodes:
+			intervals.append( (start - 1, end, strandCodes[fields[2]]) )
+		elif len(fields) > 2:
+			intervals.append( (start, end, int(fields[2])) )
+		else:
+			intervals.append( (start - 1, end, 0) )
+
+	return intervals
+
+def parseLocus(coordinates):
+	match = locusPattern.match(coordinates or '')
+	if not match:
+		raise ValueError("Invalid locus coordinates {0!r}".format(coordinates))
+
+	scaffold, start, separator, end = match.groups()
+	start = int(start) if separator == '-' else int(start) - 1
+	return scaffold, [ (start, int(end), 0) ]
+
+def encodeCoordinates(intervals):
+	data = array.array('i', [ value for interval in intervals for value in interval ])
+	if sys.byteorder != 'little':
+		data.byteswap()
+	return data.tobytes()
+
+def decodeCoordinates(data):
+	# Flat array of start, end, strand values
+	values = array.array('i')
+	values.frombytes(data or b'')
+	if sys.byteorder != 'little':
+		values.byteswap()
+	return values
+
+def decodeIntervals(data):
+	values = decodeCoordinates(data)
+	return [ tuple(values[i:i+3]) for i in range(0, len(values), 3) ]
+
+def decodeMany(blobs):
+	# Decodes many packed values at once into one (n, 3) array and the row
+	# offsets of every value, rows offsets[i]:offsets[i+1] belonging to blob i
+	blobs = [ blob or b'' for blob in blobs ]
+
+	offsets = [0]
+	for blob in blobs:
+		offsets.append( offsets[-1] + len(blob) // 12 )
+
+	if numpy is None:
+		values = decodeCoordinates( b''.join(blobs) )
+		return [ values[i:i+3] for i in range(0, len(values), 3) ], offsets
+
+	values = numpy.frombuffer( b''.join(blobs), dtype = '<i4' ).reshape(-1, 3)
+	return values, numpy.array(offsets)
+
+def intervalsToLocation(intervals, strand = None):
+	# Biopython location of the intervals, a CompoundLocation for several
+	# intervals. strand overrides the stored strands.
+	locations = [ FeatureLocation(int(start), int(end), strand = strand if strand is not None else (int(intervalStrand) or None))
+					for start, end, intervalStrand in intervals ]
+
+	if not locations:
+		return None
+	if len(locations) > 1:
+		return CompoundLocation(locations)
+	return locations[0]
+
+def toLocation(data, strand = None):
+	return intervalsToLocation( decodeIntervals(data), strand )
@@ -1,6 +1,7 @@
 import sys
 from partsdb.partsdb import PartsDB
 from .tables import *
+from .coordinates import toLocation, intervalsToLocation, parseCoordinates
 
 from Bio.Seq import Seq
 from Bio.Alphabet import generic_dna
@@ -21,7 +22,11 @@ exporter = GenBankExporter(marpodb)
 if exportFeature == 'Prot':
 
 	for gene in session.query(Gene).all():
-		feature = SeqFeature( location = exporter.coordinatesToLocation(gene.cds.coordinates) )
+		if gene.cds.packedCoordinates:
+			location = toLocation(gene.cds.packedCoordinates)
+		else:
+			location = intervalsToLocation( parseCoordinates(gene.cds.coordinates) )
+		feature = SeqFeature( location = location )
 		seq = feature.extract(Seq(gene.cds.seq, generic_dna)).translate()
 		if not (seq[0] == 'M' and seq.find('*') == len(seq)-1):
 			print(gene.cds.dbid, seq)
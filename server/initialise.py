@@ -2,6 +2,10 @@ import sys
 from partsdb.partsdb import PartsDB
 from partsdb.tools.Populators import PlantPopulator
 from .tables import *
+from .cache import bumpDataVersion
+from .system import refreshPartSites, packCoordinates
+from .seqindex import buildSequenceIndex
+from .recoding import getEnzymes
 from partsdb.tools.Exporters import GenBankExporter
 
 from Bio.Seq import Seq
@@ -20,3 +24,12 @@ marpodb.setup(prefix = "mpdb")
 ppl = PlantPopulator(marpodb)
 
 ppl.populate(mapFileName, transcriptFileName, proteinFileName,  genomeFileName)
+
+session = marpodb.Session()
+buildSequenceIndex(session)
+session.close()
+
+packCoordinates(marpodb.engine)
+refreshPartSites(marpodb.engine, getEnzymes())
+
+bumpDataVersion()
@@ -0,0 +1,46 @@
+import sys
+from partsdb.partsdb import PartsDB
+from .tables import *
+from .recoding import SiteScanner, getEnzymes
+from .system import getRecodeSequence, splitString, geneQuery
+
+# Recodes one part type (cds, promoter or promoter5) of every gene, or of the
+# genes listed one dbid per line in an optional file, into a FASTA file
+
+seqType = sys.argv[2]
+
+marpodb = PartsDB('postgresql:///'+sys.argv[1], Base = Base)
+session = marpodb.Session()
+
+query = geneQuery(session)
+
+if len(sys.argv) > 3:
+	with open(sys.argv[3]) as dbidFile:
+		geneDBIDs = [ line.strip() for line in dbidFile if line.strip() ]
+	query = query.filter(Gene.dbid.in_(geneDBIDs))
+
+scanner = SiteScanner( getEnzymes() )
+
+outputFileName = 'data/recoded_{0}.fa'.format(seqType)
+outputFile = open(outputFileName, 'w')
+
+nRecoded = 0
+nSites = 0
+
+for gene in query.order_by(Gene.dbid).yield_per(1000):
+	seq = getRecodeSequence(gene, seqType)
+	if seq is None:
+		continue
+
+	newseq, sites = scanner.recode(seq)
+	siteCounts = ' '.join( "{0}={1}".format(name, len(positions)) for name, positions in sites.items() )
+
+	outputFile.write( ">{0} {1}\n{2}\n".format(gene.dbid, siteCounts, "\n".join( splitString(newseq, 60) )) )
+
+	nRecoded += 1
+	nSites += sum( len(positions) for positions in sites.values() )
+
+outputFile.close()
+session.close()
+
+print("Recoded {0} sites in {1} sequences to {2}".format(nSites, nRecoded, outputFileName))
@@ -0,0 +1,131 @@
+import os
+
+from collections import deque, OrderedDict
+
+complement = str.maketrans('ACGTacgt', 'TGCAtgca')
+
+def reverseComplement(seq):
+	return seq.translate(complement)[::-1]
+
+class TypeIISEnzyme(object):
+	# A recognition site and its silent replacements on both strands. The
+	# replacement used for a site is picked by the frame of its position.
+
+	def __init__(self, name, site, forwardReplacements, reverseReplacements):
+		self.name = name
+		self.site = site.upper()
+		self.reverseSite = reverseComplement(self.site)
+		self.forwardReplacements = forwardReplacements
+		self.reverseReplacements = reverseReplacements
+
+	def patterns(self):
+		patterns = [ (self.site, 1, self.forwardReplacements) ]
+		if self.reverseSite != self.site:
+			patterns.append( (self.reverseSite, -1, self.reverseReplacements) )
+		return patterns
+
+defaultEnzymes = [ TypeIISEnzyme('BsaI', 'GGTCTC', ["GGaCTC","GGTCcC","GGTaTC"], ["GAaACC","GAGAtC" ,"GAGgCC"]),\
+					TypeIISEnzyme('SapI', 'GCTCTTC', ["GCcCTTC","GCTCgTC","GCTgTTC"], ["GAgGAGC","GAAGgGC","GAAaAGC"]) ]
+
+knownEnzymes = OrderedDict( (enzyme.name, enzyme) for enzyme in defaultEnzymes )
+
+def getEnzymes(names = None):
+	# Enzymes by name, a comma separated list taken from MARPODB_ENZYMES
+	# unless given. Without names all known enzymes are used.
+	if names is None:
+		names = os.environ.get("MARPODB_ENZYMES", '')
+
+	names = [ name.strip() for name in names.split(',') if name.strip() ]
+	if not names:
+		return defaultEnzymes
+
+	unknown = [ name for name in names if not name in knownEnzymes ]
+	if unknown:
+		raise ValueError("Unknown enzymes {0}, known are {1}".format(', '.join(unknown), ', '.join(knownEnzymes)))
+
+	return [ knownEnzymes[name] for name in names ]
+
+class SiteScanner(object):
+	# Aho-Corasick automaton over the sites of all enzymes on both strands, so
+	# that a sequence is scanned once whatever the number of enzymes
+
+	def __init__(self, enzymes = defaultEnzymes):
+		self.enzymes = enzymes
+
+		self.goto = [{}]
+		self.fail = [0]
+		self.output = [[]]
+
+		for enzymeIndex, enzyme in enumerate(enzymes):
+			for pattern, strand, replacements in enzyme.patterns():
+				self._add(pattern, (enzymeIndex, strand, len(pattern)))
+
+		self._link()
+
+	def _add(self, pattern, value):
+		node = 0
+		for base in pattern:
+			if not base in self.goto[node]:
+				self.goto.append({})
+				self.fail.append(0)
+				self.output.append([])
+				self.goto[node][base] = len(self.goto) - 1
+			node = self.goto[node][base]
+		self.output[node].append(value)
+
+	def _link(self):
+		# Children of the root fail back to the root, which they already do
+		queue = deque( self.goto[0].values() )
+
+		while queue:
+			node = queue.popleft()
+			for base, child in self.goto[node].items():
+				queue.append(child)
+
+				state = self.fail[node]
+				while state and not base in self.goto[state]:
+					state = self.fail[state]
+				self.fail[child] = self.goto[state].get(base, 0)
+				self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+	def scan(self, seq):
+		# Yields (position, enzyme index, strand) of every site in seq
+		node = 0
+		for i, base in enumerate(seq.upper()):
+			while node and not base in self.goto[node]:
+				node = self.fail[node]
+			node = self.goto[node].get(base, 0)
+
+			for enzymeIndex, strand, length in self.output[node]:
+				yield i - length + 1, enzymeIndex, strand
+
+	def _found(self, seq):
+		# Sites ordered by enzyme, forward strand first, then by position
+		return sorted( self.scan(seq), key = lambda site: (site[1], -site[2], site[0]) )
+
+	def sites(self, seq):
+		found = self._found(seq)
+
+		sites = OrderedDict( (enzyme.name, []) for enzyme in self.enzymes )
+		for position, enzymeIndex, strand in found:
+			sites[ self.enzymes[enzymeIndex].name ].append(position)
+
+		return sites
+
+	def recode(self, seq):
+		# Replaces every site with its silent variant, returning the new
+		# sequence and the site positions by enzyme name
+		found = self._found(seq)
+
+		buffer = list(seq)
+		sites = OrderedDict( (enzyme.name, []) for enzyme in self.enzymes )
+
+		for position, enzymeIndex, strand in found:
+			enzyme = self.enzymes[enzymeIndex]
+			replacements = enzyme.forwardReplacements if strand == 1 else enzyme.reverseReplacements
+
+			replacement = replacements[position % len(replacements)]
+			buffer[position:position+len(replacement)] = replacement
+			sites[enzyme.name].append(position)
+
+		return ''.join(buffer), sites
@@ -0,0 +1,279 @@
+import os
+import json
+import shutil
+import mmap
+import array
+import bisect
+
+from .tables import *
+
+# Sequences of every part are concatenated into one text, separated by a
+# newline, and indexed by their k-mers in CSR layout: the positions of k-mer
+# code c are positions[offsets[c]:offsets[c+1]]. A second table of short
+# k-mers seeds patterns shorter than k. All files are memory-mapped, so
+# loading the index costs no parsing and very little memory.
+
+# Locus is only indexed when the schema gives it a sequence column
+partClasses = [ cls for cls in [Promoter, UTR5, CDS, UTR3, Terminator, Locus] if hasattr(cls, 'seq') ]
+
+baseCodes = {'A': 0, 'C': 1, 'G': 2, 'T': 3}
+complement = str.maketrans('ACGTN', 'TGCAN')
+
+def reverseComplement(seq):
+	return seq.translate(complement)[::-1]
+
+def iterKmers(seq, k):
+	# Yields (offset, code) of every k-mer of seq that has no ambiguous bases
+	mask = (1 << (2*k)) - 1
+	code = 0
+	valid = 0
+
+	for i, base in enumerate(seq):
+		value = baseCodes.get(base)
+		if value is None:
+			valid = 0
+			code = 0
+			continue
+
+		code = ((code << 2) | value) & mask
+		valid += 1
+
+		if valid >= k:
+			yield i - k + 1, code
+
+def kmerCode(kmer):
+	code = 0
+	for base in kmer:
+		value = baseCodes.get(base)
+		if value is None:
+			return None
+		code = (code << 2) | value
+	return code
+
+def getPartGenes(session):
+	# Maps (table, part id) to the locus and gene dbids the part belongs to
+	partGenes = {}
+
+	genes = session.query(Gene.dbid, Locus.id, Locus.dbid, Gene.promoterID, Gene.utr5ID, Gene.cdsID, Gene.utr3ID, Gene.terminatorID).\
+				filter(Locus.id == Gene.locusID)
+
+	for geneDBID, locusID, locusDBID, promoterID, utr5ID, cdsID, utr3ID, terminatorID in genes:
+		for table, partID in [('promoter', promoterID), ('utr5', utr5ID), ('cds', cdsID), ('utr3', utr3ID), ('terminator', terminatorID), ('locus', locusID)]:
+			if partID is not None:
+				entry = partGenes.setdefault( (table, partID), [locusDBID, []] )
+				entry[1].append(geneDBID)
+
+	return partGenes
+
+def buildSequenceIndex(session, directory = 'data/seqindex', k = 11, smallK = 6):
+	# The index is built next to the old one and swapped in at the end, so
+	# that running servers keep reading their memory-mapped copy
+	finalDirectory = directory
+	directory = finalDirectory + '.new'
+
+	if os.path.isdir(directory):
+		shutil.rmtree(directory)
+	os.makedirs(directory)
+
+	partGenes = getPartGenes(session)
+
+	records = []
+	starts = array.array('Q')
+	tables = [ ('', k, array.array('Q', [0]) * (4**k + 1)), ('small', smallK, array.array('Q', [0]) * (4**smallK + 1)) ]
+	position = 0
+
+	# First pass: writing the text and counting k-mers
+	with open(os.path.join(directory, 'text.bin'), 'wb') as textFile:
+		for cls in partClasses:
+			for partID, dbid, seq in session.query(cls.id, cls.dbid, cls.seq).yield_per(1000):
+				if not seq:
+					continue
+
+				seq = seq.upper()
+				locusDBID, geneDBIDs = partGenes.get( (cls.__tablename__, partID), [None, []] )
+
+				records.append( [cls.__tablename__, dbid, locusDBID, geneDBIDs] )
+				starts.append(position)
+
+				for prefix, size, counts in tables:
+					for offset, code in iterKmers(seq, size):
+						counts[code+1] += 1
+
+				textFile.write( (seq + '\n').encode('ascii') )
+				position += len(seq) + 1
+
+	starts.append(position)
+
+	with open(os.path.join(directory, 'starts.bin'), 'wb') as dataFile:
+		starts.tofile(dataFile)
+
+	for prefix, size, counts in tables:
+		for code in range(1, len(counts)):
+			counts[code] += counts[code-1]
+
+		# Second pass: filling the positions of every k-mer bucket
+		positions = array.array('I', [0]) * counts[-1]
+		fill = array.array('Q', counts)
+
+		with open(os.path.join(directory, 'text.bin'), 'rb') as textFile:
+			for start in starts[:-1]:
+				seq = textFile.readline().decode('ascii').rstrip('\n')
+				for offset, code in iterKmers(seq, size):
+					positions[fill[code]] = start + offset
+					fill[code] += 1
+
+		for name, data in [(prefix + 'offsets.bin', counts), (prefix + 'positions.bin', positions)]:
+			with open(os.path.join(directory, name), 'wb') as dataFile:
+				data.tofile(dataFile)
+
+	with open(os.path.join(directory, 'meta.json'), 'w') as metaFile:
+		json.dump( {'k': k, 'smallK': smallK, 'records': records}, metaFile )
+
+	if os.path.isdir(finalDirectory):
+		os.rename(finalDirectory, finalDirectory + '.old')
+	os.rename(directory, finalDirectory)
+	shutil.rmtree(finalDirectory + '.old', ignore_errors = True)
+
+class SequenceIndex(object):
+
+	def __init__(self, directory = 'data/seqindex'):
+		with open(os.path.join(directory, 'meta.json')) as metaFile:
+			meta = json.load(metaFile)
+
+		self.k = meta['k']
+		self.records = meta['records']
+
+		self.files = []
+		self.maps = []
+		self.views = []
+		self.text = self._map(directory, 'text.bin')
+		self.starts = self._view(directory, 'starts.bin', 'Q')
+
+		# (k, offsets, positions) of the k-mer tables, longest k first.
+		# Indexes built before the short k-mer table only have the first.
+		self.tables = [ (self.k, self._view(directory, 'offsets.bin', 'Q'), self._view(directory, 'positions.bin', 'I')) ]
+		if 'smallK' in meta:
+			self.tables.append( (meta['smallK'], self._view(directory, 'smalloffsets.bin', 'Q'), self._view(directory, 'smallpositions.bin', 'I')) )
+
+	def _map(self, directory, name):
+		# Empty files, e.g. the text of an empty database, cannot be mapped
+		dataFile = open(os.path.join(directory, name), 'rb')
+		if os.fstat(dataFile.fileno()).st_size == 0:
+			dataFile.close()
+			return b''
+
+		self.files.append(dataFile)
+		data = mmap.mmap(dataFile.fileno(), 0, access = mmap.ACCESS_READ)
+		self.maps.append(data)
+		return data
+
+	def _view(self, directory, name, format):
+		view = memoryview(self._map(directory, name))
+		self.views.append(view)
+		self.views.append( view.cast(format) )
+		return self.views[-1]
+
+	def close(self):
+		# Views have to be released before their maps can be closed
+		for view in reversed(self.views):
+			view.release()
+		for data in self.maps:
+			data.close()
+		for dataFile in self.files:
+			dataFile.close()
+
+		self.views, self.maps, self.files = [], [], []
+
+	def _table(self, length):
+		# The table with the longest k-mers that fit into length bases
+		for table in self.tables:
+			if table[0] <= length:
+				return table
+		return None
+
+	def _candidates(self, pattern, mismatches):
+		# Pigeonhole seeding: with d mismatches at least one of d+1 segments
+		# of the pattern matches exactly. Each segment is seeded with its
+		# rarest k-mer.
+		segmentLen = len(pattern) // (mismatches + 1)
+		k, offsets, positions = self._table(segmentLen)
+		candidates = set()
+
+		for segment in range(mismatches + 1):
+			segmentStart = segment * segmentLen
+			best = None
+
+			for offset in range(segmentStart, segmentStart + segmentLen - k + 1):
+				code = kmerCode(pattern[offset:offset+k])
+				if code is None:
+					continue
+				size = offsets[code+1] - offsets[code]
+				if best is None or size < best[0]:
+					best = (size, offset, code)
+
+			if best is None:
+				continue
+
+			size, offset, code = best
+			candidates.update( position - offset for position in positions[ offsets[code] : offsets[code+1] ] if position >= offset )
+
+		return candidates
+
+	def _scan(self, pattern):
+		# Patterns shorter than the shortest k fall back to a linear scan
+		needle = pattern.encode('ascii')
+		position = self.text.find(needle)
+		while position != -1:
+			yield position
+			position = self.text.find(needle, position + 1)
+
+	def _locate(self, position, length):
+		record = bisect.bisect_right(self.starts, position) - 1
+		start = self.starts[record]
+
+		# Matches must not run into the next record
+		if position + length > self.starts[record+1] - 1:
+			return None
+
+		return record, position - start
+
+	def find(self, pattern, mismatches = 0, limit = 1000):
+		pattern = pattern.upper()
+
+		minK = self.tables[-1][0]
+
+		if len(pattern) < minK and mismatches == 0:
+			search = lambda query: self._scan(query)
+		elif len(pattern) // (mismatches + 1) >= minK:
+			search = lambda query: sorted( self._candidates(query, mismatches) )
+		else:
+			raise ValueError("Sequence must be at least {0} bases long for {1} mismatches".format(minK * (mismatches + 1), mismatches))
+
+		hits = []
+		strands = [(1, pattern)]
+		if reverseComplement(pattern) != pattern:
+			strands.append( (-1, reverseComplement(pattern)) )
+
+		for strand, query in strands:
+			needle = query.encode('ascii')
+
+			for position in search(query):
+				located = self._locate(position, len(query))
+				if not located:
+					continue
+
+				target = self.text[position:position+len(query)]
+				distance = sum( 1 for a, b in zip(needle, target) if a != b )
+				if distance > mismatches:
+					continue
+
+				record, offset = located
+				table, dbid, locusDBID, geneDBIDs = self.records[record]
+
+				hits.append( {'table': table, 'dbid': dbid, 'start': offset + 1, 'end': offset + len(query), 'strand': strand,\
+								'mismatches': distance, 'locus': locusDBID, 'genes': geneDBIDs} )
+
+				if len(hits) >= limit:
+					return hits
+
+		return hits
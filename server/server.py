@@ -3,13 +3,17 @@ from .tables import *
 
 from partsdb.tools.Exporters import GenBankExporter
 
-from flask import Flask, session, redirect, url_for, escape, request, render_template, make_response, flash, abort
+from flask import Flask, session, redirect, url_for, escape, request, render_template, make_response, flash, abort, jsonify, Response, stream_with_context
 from flask.ext.sqlalchemy import SQLAlchemy
 from flask_user import UserMixin, SQLAlchemyAdapter, UserManager, LoginManager
 from flask_login import login_user, login_required, logout_user, current_user, user_logged_in
 
 from .user import RegisterForm, LoginForm
-from .system import getUserData, generateNewMap, getTopGenes, processQuery, getGeneCoordinates, getCDSDetails, parseBlastResult, recfind
+from .cache import createCache, ResultCache, DiskCache
+from .blastqueue import BlastQueue, blastDatabase, blastPrograms, blastCacheKey
+from .seqindex import SequenceIndex
+from .system import getUserData, generateNewMap, getTopGenes, rankLoci, getLociPage, processLoci, resolveDBID, getLocusGenes, getLocusPayload, getGenes, getStarredGeneDBIDs, zipStream, streamMatches, streamSequences, exportParts, csvLines, getCDSDetails, getHitsCoveringResidue, parseBlastResult, getRecodeSequence, findPartsBySites, siteParts
+from .recoding import SiteScanner, getEnzymes
 
 from Bio.Seq import Seq
 from Bio.SeqRecord import SeqRecord
@@ -17,8 +21,10 @@ from Bio.SeqFeature import SeqFeature, FeatureLocation, CompoundLocation
 from Bio.Alphabet import IUPAC
 
 import os
+import re
 import sys
-import subprocess
+
+from collections import OrderedDict
 
 marpodb = PartsDB('postgresql:///' + os.environ["MARPODB_DB_NAME"], Base = Base)
 
@@ -31,6 +37,30 @@ userDB = SQLAlchemy(app)
 loginManager = LoginManager()
 loginManager.init_app(app)
 
+resultCache = createCache('results')
+sidebarCache = createCache('sidebar', 1024, localTTL = 5)
+topGenesCache = createCache('top', 16, ttl = 60)
+locusCache = createCache('locus', 1024)
+genbankCache = createCache('genbank', 4096)
+
+exportBatchSize = 100
+siteScanner = SiteScanner( getEnzymes() )
+
+sequenceIndexDir = os.environ.get("MARPODB_SEQINDEX_DIR", 'data/seqindex')
+sequenceIndex = {'index': None, 'stamp': None}
+
+blastCache = ResultCache( DiskCache( os.path.join(os.environ.get("MARPODB_CACHE_DIR", 'data/cache'), 'blast'), int(os.environ.get("MARPODB_BLAST_CACHE_SIZE", 2048)) ) )
+blastQueue = BlastQueue( maxJobs = int(os.environ.get("MARPODB_BLAST_JOBS", 2)), numThreads = int(os.environ.get("MARPODB_BLAST_THREADS", 1)),\
+						numAlignments = int(os.environ.get("MARPODB_BLAST_ALIGNMENTS", 10)), jobTimeout = int(os.environ.get("MARPODB_BLAST_TIMEOUT", 3600)),\
+						maxAge = int(os.environ.get("MARPODB_BLAST_JOB_AGE", 86400)) )
+
+nHits = 5
+pageSize = 50
+searchColumns = { 'pfamhit'	: [PfamHit.name, PfamHit.acc, PfamHit.eVal, PfamHit.description],\
+				'blastphit': [BlastpHit.proteinName, BlastpHit.geneName, BlastpHit.origin, BlastpHit.eVal],\
+				'cds'		: [CDS.dbid]\
+}
+
 class User(userDB.Model, UserMixin):
 	id = userDB.Column(userDB.Integer(), primary_key = True)
 	username = userDB.Column(userDB.String(50), nullable = False, unique = True)
@@ -42,7 +72,7 @@ class User(userDB.Model, UserMixin):
 class StarGene(userDB.Model):
 	id = userDB.Column(userDB.Integer(), primary_key = True)
 	userid = userDB.Column(userDB.Integer, userDB.ForeignKey('user.id'))
-	cdsdbid = userDB.Column(userDB.Text)
+	cdsdbid = userDB.Column(userDB.Text, index = True)
 	def __init__(self, userid = None, cdsdbid = None):
 		self.userid = userid
 		self.cdsdbid = cdsdbid
@@ -50,18 +80,32 @@ class StarGene(userDB.Model):
 db_adapter = SQLAlchemyAdapter(userDB,  User)
 user_manager = UserManager(db_adapter, app)
 userDB.create_all()
+userDB.engine.execute("CREATE INDEX IF NOT EXISTS ix_star_gene_cdsdbid ON star_gene (cdsdbid)")
 
 @loginManager.user_loader
 def load_user(username):
 	User.query.filter(User.username == username).first()
 
+def sidebarKey():
+	# Anonymous stars live in the session, so their string identifies the payload
+	if current_user.is_authenticated:
+		return ('user', current_user.id)
+	else:
+		if not "stars" in session:
+			session["stars"] = ""
+		return ('anonymous', session["stars"])
+
 @app.context_processor
 def user_data():
-	marpodbSession = marpodb.Session()
-	userData = getUserData(StarGene, current_user, session, marpodbSession)
-	
-	marpodbSession.close()
-	print("userData:", userData)
+	key = sidebarKey()
+	userData = sidebarCache.get(key)
+
+	if userData is None:
+		marpodbSession = marpodb.Session()
+		userData = getUserData(StarGene, current_user, session, marpodbSession)
+		marpodbSession.close()
+
+		sidebarCache.set(key, userData)
 
 	return dict(user_data = userData)
 
@@ -84,9 +128,10 @@ def query():
 		scope = request.form.getlist("searchScope")
 		scope = '|'.join(scope)
 		term = request.form["term"]
+		mode = request.form.get("mode", "substring")
 
 		if scope !="" and term !="":
-			return redirect(url_for('result', term=request.form['term'], scope = scope))
+			return redirect(url_for('result', term=request.form['term'], scope = scope, mode = mode))
 		else:
 			flash('Empty search term or scope')
 	return render_template("query.html", loginForm = loginForm)
@@ -105,33 +150,136 @@ def login():
 		flash("Invalid username or/and password")
 	return redirect(url_for('index'))
 
-@app.route('/results')
-def result():
-	nHits = 5
-   	columns = { 'pfamhit'	: [PfamHit.name, PfamHit.acc, PfamHit.eVal, PfamHit.description],\
-   				'blastphit': [BlastpHit.proteinName, BlastpHit.geneName, BlastpHit.origin, BlastpHit.eVal],\
-   				'cds'		: [CDS.dbid]\
-   	}
+def searchArgs():
+	# Matching is case-insensitive in every mode, so the term is normalised
+	# once and the same value is searched for and used in the cache keys
+	term = request.args.get('term','').strip().lower()
+	scope = [ item for item in request.args.get('scope','').split('|') if item ]
+	mode = request.args.get('mode','substring')
 
-	marpodbSession = marpodb.Session()
+	return term, scope, mode, (term, tuple(sorted(set(scope))), mode)
+
+def getRankedLoci(term, scope, mode, queryKey):
+	rankedLoci = resultCache.get( ('loci',) + queryKey )
+
+	if rankedLoci is None:
+		marpodbSession = marpodb.Session()
+		rankedLoci = rankLoci(marpodbSession, scope, term, searchColumns, mode)
+		marpodbSession.close()
+
+		resultCache.set( ('loci',) + queryKey, rankedLoci )
 
-	term = request.args.get('term','')
-	scope = request.args.get('scope','').split('|')
+	return rankedLoci
+
+def getResultPage(term, scope, mode, queryKey, cursor, limit):
+	rankedLoci = getRankedLoci(term, scope, mode, queryKey)
+	pageKey = ('page',) + queryKey + (cursor, limit, nHits)
+
+	page = resultCache.get(pageKey)
+
+	if page is None:
+		locusDBIDs, nextCursor = getLociPage(rankedLoci, cursor, limit)
+
+		marpodbSession = marpodb.Session()
+		header, loci = processLoci(marpodbSession, scope, term, searchColumns, nHits, mode, locusDBIDs)
+		marpodbSession.close()
+
+		page = {'header': header, 'loci': loci, 'cursor': nextCursor, 'total': len(rankedLoci)}
+		resultCache.set(pageKey, page)
+
+	return page
+
+@app.route('/results')
+def result():
+	term, scope, mode, queryKey = searchArgs()
 
 	if not (term and scope):
 		 flash('Empyt search term or scope')
 		 return redirect(url_for('query'))
 
-	table = processQuery(marpodbSession, scope, term, columns, nHits)
-
-	marpodbSession.close()
+	page = getResultPage(term, scope, mode, queryKey, None, pageSize)
 
-	if len(table['data']) != 0:
-		return render_template('results.html', table = table, title='Query results')
+	if len(page['loci']) != 0:
+		query = {'term': term, 'scope': '|'.join(scope), 'mode': mode}
+		return render_template('results.html', header = page['header'], loci = page['loci'], cursor = page['cursor'], total = page['total'], query = query, title='Query results')
 	else:
 		flash("No entries found")
 		return redirect(url_for('index'))
 
+@app.route('/api/results')
+def apiResults():
+	term, scope, mode, queryKey = searchArgs()
+
+	if not (term and scope):
+		abort(404)
+
+	cursor = request.args.get('cursor', None) or None
+
+	try:
+		limit = max( min( int(request.args.get('limit', pageSize)), 500 ), 1 )
+	except ValueError:
+		limit = pageSize
+
+	page = getResultPage(term, scope, mode, queryKey, cursor, limit)
+
+	return jsonify( header = page['header'], total = page['total'], cursor = page['cursor'],\
+					loci = [ {'dbid': locus['dbid'], 'cols': locus['cols']} for locus in page['loci'] ] )
+
+@app.route('/export/results')
+def exportResults():
+	# Everything a search matched, as a CSV of the hits or as FASTA of one
+	# part type of the matching genes, streamed while it is read
+	term, scope, mode, queryKey = searchArgs()
+	exportFormat = request.args.get('format', 'csv')
+	part = request.args.get('part', 'cds')
+
+	if not (term and scope) or not part in exportParts:
+		abort(404)
+
+	def generate():
+		marpodbSession = marpodb.Session()
+		try:
+			if exportFormat == 'fasta':
+				for record in streamSequences(marpodbSession, scope, term, part, mode):
+					yield record
+			else:
+				for line in csvLines( streamMatches(marpodbSession, scope, term, searchColumns, mode) ):
+					yield line
+		finally:
+			marpodbSession.close()
+
+	if exportFormat == 'fasta':
+		mimetype, fileName = 'text/plain', 'marpodb_{0}.fa'.format(part)
+	else:
+		mimetype, fileName = 'text/csv', 'marpodb_results.csv'
+
+	response = Response(stream_with_context(generate()), mimetype = mimetype)
+	response.headers["Content-Disposition"] = "attachement; filename={0}".format(fileName)
+	return response
+
+@app.route('/api/results/locus')
+def apiResultsLocus():
+	term, scope, mode, queryKey = searchArgs()
+	dbid = request.args.get('dbid','')
+
+	if not (term and scope and dbid):
+		abort(404)
+
+	locusKey = ('locus',) + queryKey + (dbid, nHits)
+	loci = resultCache.get(locusKey)
+
+	if loci is None:
+		marpodbSession = marpodb.Session()
+		header, loci = processLoci(marpodbSession, scope, term, searchColumns, nHits, mode, [dbid])
+		marpodbSession.close()
+
+		resultCache.set(locusKey, loci)
+
+	if not loci:
+		abort(404)
+
+	return jsonify( dbid = dbid, cols = loci[0]['cols'], genes = loci[0]['genes'] )
+
 @app.route('/details')
 def details():
 	dbid = request.args.get('dbid','')
@@ -141,52 +289,45 @@ def details():
 
 	marpodbSession = marpodb.Session()
 
-	locus = None
-	gene  = None
-	cds   = None
+	resolved = resolveDBID(marpodbSession, dbid)
 
-	locus = marpodbSession.query(Locus).filter(Locus.dbid == dbid).first()
+	if not resolved:
+		marpodbSession.close()
+		abort(404)
 
-	if not locus:
-		
-		gene = marpodbSession.query(Gene).filter(Gene.dbid == dbid).first()
-		
-		# if CDS
-		if not gene:
-			cds = marpodbSession.query(CDS).filter(CDS.dbid == dbid).first()
-			if cds:
-				gene  = marpodbSession.query(Gene).filter(Gene.cdsID == cds.id).first()
-				locus = marpodbSession.query(Locus).filter(Locus.id == Gene.locusID).\
-						filter(Gene.cdsID == cds.id).first()
-		# if Gene
-		else:
-			locus = marpodbSession.query(Locus).filter(Locus.id == gene.locusID).first()
-			cds = marpodbSession.query(CDS).filter(CDS.id == gene.cdsID).first()
-	else:
-		# if Locus:
-		gene = marpodbSession.query(Gene).filter(Gene.locusID == locus.id).first()
-		cds = marpodbSession.query(CDS).filter(CDS.id == Gene.cdsID).\
-					filter(Gene.locusID == locus.id).first()
+	dbidType, dbidID, locusID = resolved
 
-	if not cds:
-		abort(404)
+	payload = locusCache.get(locusID)
+
+	if payload is None:
+		payload = getLocusPayload( getLocusGenes(marpodbSession, locusID) )
+		locusCache.set(locusID, payload)
+
+	models = payload['models']
 
-	print("Debug: ", cds.dbid)
+	if dbidType == 'gene':
+		gene = next( (g for g in models if g['id'] == dbidID), None )
+	elif dbidType == 'cds':
+		gene = next( (g for g in models if g['cdsID'] == dbidID), None )
+	else:
+		gene = next( (g for g in models if g['cdsDBID']), None )
 
-	response = getGeneCoordinates(marpodbSession, locus.id)
+	if not (gene and gene['cdsDBID']):
+		marpodbSession.close()
+		abort(404)
 
-	annotation = getCDSDetails(marpodbSession, cds.dbid)
+	annotation = getCDSDetails(marpodbSession, gene['cdsDBID'])
 	
 	marpodbSession.close()
 
 	stared = False
 	if current_user.is_authenticated:
-		if StarGene.query.filter(StarGene.userid == current_user.id, StarGene.cdsdbid == cds.dbid).first():
+		if StarGene.query.filter(StarGene.userid == current_user.id, StarGene.cdsdbid == gene['cdsDBID']).first():
 			stared = True
 	else:
 		if not "stars" in session:
 			session["stars"] = ""
-		if session["stars"].find(str(cds.id)) > -1:
+		if session["stars"].find(str(gene['cdsID'])) > -1:
 			stared = True
 
 	if stared:
@@ -194,7 +335,27 @@ def details():
 	else:
 		titleEx = '<img src="static/img/star_na.png" onclick="starGene()" id="star_img"/>'
 
-	return render_template('details.html', geneDBID = gene.dbid, cdsDBID = cds.dbid, geneCoordinates = response['genes'], seq = response['seq'],  title = "Details for {0}".format(gene.dbid), titleEx = titleEx, blastp=annotation['blastp'], stared = stared )
+	return render_template('details.html', geneDBID = gene['dbid'], cdsDBID = gene['cdsDBID'], geneCoordinates = payload['genes'], seq = payload['seq'],  title = "Details for {0}".format(gene['dbid']), titleEx = titleEx, blastp=annotation['blastp'], stared = stared )
+
+@app.route('/api/details/residue')
+def detailsResidue():
+	# BLASTp hits of a CDS with an HSP covering one residue of the protein
+	dbid = request.args.get('dbid','')
+
+	try:
+		residue = int(request.args.get('residue', ''))
+	except ValueError:
+		abort(400)
+
+	if not dbid:
+		abort(404)
+
+	marpodbSession = marpodb.Session()
+	hits = [ {'uniID': hit.uniID, 'proteinName': hit.proteinName, 'geneName': hit.geneName, 'origin': hit.origin, 'eVal': hit.eVal}\
+				for hit in getHitsCoveringResidue(marpodbSession, dbid, residue) ]
+	marpodbSession.close()
+
+	return jsonify(dbid = dbid, residue = residue, hits = hits)
 
 @app.route('/blast', methods=['GET', 'POST'])
 def blast():
@@ -225,56 +386,179 @@ def blast_result():
 		abort(500)
 
 	# Validate fasta PENDING!
-	
-	if (program.startswith('blastn') or program == 'tblastx'):
-		route = 'blast/MarpoDB_Genes'
-		idType = 'Gene'
-	else:
-		route = 'blast/MarpoDB_Proteins'
-		idType = 'CDS'
 
-	if (program.startswith('blastn') ):
-		cmd = subprocess.Popen( program.split() + ['-db', route, '-evalue', evalue,'-num_alignments', '10', '-num_threads', '1', '-outfmt', '15', '-perc_identity' , perc], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-	else:	
-		cmd = subprocess.Popen( program.split() + ['-db', route, '-evalue', evalue,'-num_alignments', '10', '-num_threads', '1', '-outfmt', '15', '-matrix', matrix], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-	
-	out,error = cmd.communicate(query)
+	if not program in blastPrograms:
+		abort(400)
 
-	# print "CMD output: ", out
-	# print "CMD error:", error
-	
-	session = marpodb.Session()
-	results = parseBlastResult(out, session)
-	session.close()
+	cacheKey = blastCacheKey(query, program, evalue, matrix, perc, blastQueue.numAlignments)
+	results = blastCache.get(cacheKey)
+
+	if results is not None:
+		route, idType = blastDatabase(program)
+		return render_template('blast_result.html', title='BLAST result', result = results, idType = idType )
+
+	jobID = blastQueue.submit(query, program, evalue, matrix, perc, cacheKey)
+
+	return redirect(url_for('blast_job', job = jobID))
+
+@app.route('/blast_job')
+def blast_job():
+	jobID = request.args.get('job','')
+
+	status = blastQueue.status(jobID)
+
+	if status == 'unknown':
+		abort(404)
+
+	if status == 'failed':
+		app.logger.error("BLAST job %s failed: %s", jobID, blastQueue.error(jobID))
+		return render_template('error.html', title="BLAST failed", message="Sorry, the BLAST search could not be completed")
+
+	if status == 'running':
+		return render_template('blast_wait.html', title='BLAST result', job = jobID)
+
+	params = blastQueue.params(jobID)
+	route, idType = blastDatabase( params['program'] )
+
+	results = blastCache.get( params['cacheKey'] ) if params['cacheKey'] else None
+
+	if results is None:
+		session = marpodb.Session()
+		with blastQueue.result(jobID) as resultFile:
+			results = parseBlastResult(resultFile, session)
+		session.close()
+
+		if params['cacheKey']:
+			blastCache.set(params['cacheKey'], results)
 
 	return render_template('blast_result.html', title='BLAST result', result = results, idType = idType )
 
-@app.route('/export/gene')
-def exportGene():
-	dbid = request.args.get('dbid','')
+@app.route('/api/blast/status')
+def blast_status():
+	# Answers at once, clients poll instead of holding a worker
+	jobID = request.args.get('job','')
 
-	if not dbid:
-		return ('', 204)
+	status = blastQueue.status(jobID)
+
+	if status == 'unknown':
+		abort(404)
+
+	return jsonify(job = jobID, status = status)
+
+def getSequenceIndex():
+	# Maps the index on first use and again whenever it has been rebuilt
+	metaFileName = os.path.join(sequenceIndexDir, 'meta.json')
 
+	if not os.path.isfile(metaFileName):
+		return None
+
+	stamp = os.path.getmtime(metaFileName)
+	# The replaced index is not closed, requests still searching it keep it
+	# alive and it is unmapped once the last of them drops it
+	if stamp != sequenceIndex['stamp']:
+		sequenceIndex['index'] = SequenceIndex(sequenceIndexDir)
+		sequenceIndex['stamp'] = stamp
+
+	return sequenceIndex['index']
+
+@app.route('/search/sequence')
+def searchSequence():
+	seq = re.sub(r'\s', '', request.args.get('seq','')).upper()
+	index = getSequenceIndex()
+
+	if not index:
+		abort(404)
+
+	if not re.match(r'^[ACGTN]+$', seq):
+		return jsonify(error = 'Sequence must consist of A, C, G, T and N'), 400
+
+	try:
+		mismatches = min( int(request.args.get('mismatches', 0)), 3 )
+		limit = min( int(request.args.get('limit', 1000)), 10000 )
+		hits = index.find(seq, max(mismatches, 0), limit)
+	except ValueError as e:
+		return jsonify(error = str(e)), 400
+
+	return jsonify(query = seq, hits = hits)
+
+def requestGeneDBIDs(marpodbSession):
+	# Genes given as dbid parameters (repeated or comma separated), plus the
+	# starred genes of the visitor with starred=1, without duplicates
+	geneDBIDs = []
+	for value in request.values.getlist('dbid'):
+		geneDBIDs += [ dbid.strip() for dbid in value.split(',') if dbid.strip() ]
+
+	if request.values.get('starred', ''):
+		if current_user.is_authenticated:
+			cdsDBIDs = [ star.cdsdbid for star in StarGene.query.filter(StarGene.userid == current_user.id) ]
+		else:
+			cdsDBIDs = [ cdsdbid for cdsdbid in session.get("stars", "").split(':') if cdsdbid ]
+
+		geneDBIDs += getStarredGeneDBIDs(marpodbSession, cdsDBIDs)
+
+	return list( OrderedDict.fromkeys(geneDBIDs) )
+
+def genbankRecords(geneDBIDs):
+	# Yields (dbid, GenBank text) of the genes in the given order. Cached
+	# records are reused and the rest is exported one batch at a time.
 	marpodbSession = marpodb.Session()
 	exporter = GenBankExporter(marpodb)
 
-	gene = marpodbSession.query(Gene).filter(Gene.dbid == dbid).first()
-		
-	print("LOG")
+	try:
+		for start in range(0, len(geneDBIDs), exportBatchSize):
+			batch = geneDBIDs[start:start+exportBatchSize]
+			records = { dbid: genbankCache.get(dbid) for dbid in batch }
 
-	if not gene:
+			missing = [ dbid for dbid in batch if records[dbid] is None ]
+			if missing:
+				for gene in getGenes(marpodbSession, missing):
+					records[gene.dbid] = exporter.export(gene).format("gb")
+					genbankCache.set(gene.dbid, records[gene.dbid])
+
+			for dbid in batch:
+				if records[dbid] is not None:
+					yield dbid, records[dbid]
+	finally:
+		marpodbSession.close()
+
+@app.route('/export/gene')
+def exportGene():
+	dbid = request.args.get('dbid','')
+
+	if not dbid:
 		return ('', 204)
 
-	print("ID:", gene.dbid)
+	record = next( (text for geneDBID, text in genbankRecords([dbid])), None )
 
-	record = exporter.export(gene)
+	if not record:
+		return ('', 204)
 
-	response = make_response(record.format("gb"))
+	response = make_response(record)
 	response.headers["Content-Type"] = "application/octet-stream"
 	response.headers["Content-Disposition"] = "attachement; filename={0}".format(dbid+'.gb')
 	return response
 
+@app.route('/export/bulk', methods=['GET', 'POST'])
+def exportBulk():
+	# Exports the requested genes as one GenBank file or a zip archive
+	marpodbSession = marpodb.Session()
+	geneDBIDs = requestGeneDBIDs(marpodbSession)
+	marpodbSession.close()
+
+	if not geneDBIDs:
+		return ('', 204)
+
+	if request.values.get('format', 'gb') == 'zip':
+		content = zipStream( (dbid + '.gb', record) for dbid, record in genbankRecords(geneDBIDs) )
+		mimetype, fileName = 'application/zip', 'marpodb_genes.zip'
+	else:
+		content = ( record for dbid, record in genbankRecords(geneDBIDs) )
+		mimetype, fileName = 'application/octet-stream', 'marpodb_genes.gb'
+
+	response = Response(stream_with_context(content), mimetype = mimetype)
+	response.headers["Content-Disposition"] = "attachement; filename={0}".format(fileName)
+	return response
+
 @app.route('/recode')
 def recode():
 	dbid 	= request.args.get('dbid', '')
@@ -287,70 +571,78 @@ def recode():
 	gene = session.query(Gene).filter(Gene.dbid == dbid).first()
 
 	if not gene:
+		session.close()
 		abort(404)
 
-	print(seqType)
+	seq = getRecodeSequence(gene, seqType)
+	session.close()
 
-	if seqType == 'cds':
-		seq = gene.cds.seq
+	if seq is None:
+		abort(404)
 
-	elif seqType == 'promoter':
-		seq = gene.promoter.seq
+	newseq, sites = siteScanner.recode(seq)
 
-	elif seqType == "promoter5":
-		seq = gene.promoter.seq
-		if gene.utr5:
-			seq += gene.utr5.seq
-	else:
+	siteLengths = { enzyme.name: len(enzyme.site) for enzyme in siteScanner.enzymes }
+
+	return render_template('recode.html', dbid = dbid, seq = seq, seqType = seqType, sites = sites, siteLengths = siteLengths, newseq = newseq, title='Recode sequence')
+
+@app.route('/api/recode', methods=['GET', 'POST'])
+def recodeBatch():
+	# Recodes the same part of many requested genes at once
+	seqType = request.values.get('seqType', 'cds')
+
+	try:
+		limit = max( min( int(request.values.get('limit', 1000)), 10000 ), 1 )
+	except ValueError:
+		abort(400)
+
+	marpodbSession = marpodb.Session()
+	geneDBIDs = requestGeneDBIDs(marpodbSession)[:limit]
+
+	# Parts come back in the order the genes were requested
+	parts = []
+	for start in range(0, len(geneDBIDs), exportBatchSize):
+		batch = geneDBIDs[start:start+exportBatchSize]
+		genes = { gene.dbid: gene for gene in getGenes(marpodbSession, batch) }
+
+		for gene in [ genes[dbid] for dbid in batch if dbid in genes ]:
+			seq = getRecodeSequence(gene, seqType)
+			if seq is None:
+				continue
+			newseq, sites = siteScanner.recode(seq)
+			parts.append( {'dbid': gene.dbid, 'seqType': seqType, 'seq': newseq, 'sites': sites} )
+
+	marpodbSession.close()
+
+	return jsonify(parts = parts)
+
+@app.route('/api/parts/sites')
+def partsBySites():
+	# Parts with at most max sites of the given enzymes, optionally of the
+	# genes matching a search given with term, scope and mode
+	term, scope, mode, queryKey = searchArgs()
+	part = request.args.get('part', 'promoter')
+	enzymes = [ enzyme for enzyme in request.args.get('enzymes', ','.join( enzyme.name for enzyme in siteScanner.enzymes )).split(',') if enzyme ]
+
+	if not part in siteParts:
 		abort(404)
 
-	print("Seq: ", gene.promoter.seq)
-
-	seq = Seq(seq)
-
-	BsaI_F = "GGTCTC"
-	BsaI_F_replace = ["GGaCTC","GGTCcC","GGTaTC"]
-	BsaI_R = "GAGACC"
-	BsaI_R_replace = ["GAaACC","GAGAtC" ,"GAGgCC"]
-	SapI_F = "GCTCTTC"
-	SapI_F_replace = ["GCcCTTC","GCTCgTC","GCTgTTC"]
-	SapI_R = "GAAGAGC"
-	SapI_R_replace = ["GAgGAGC","GAAGgGC","GAAaAGC"]
-	BsaI_sitesF = []
-	BsaI_sitesR = []
-	SapI_sitesF = []
-	SapI_sitesR = []
-	
-	BsaI_sitesF = BsaI_sitesF + recfind(BsaI_F, seq)
-	BsaI_sitesR = BsaI_sitesR + recfind(BsaI_R, seq)
-	SapI_sitesF = SapI_sitesF + recfind(SapI_F, seq)
-	SapI_sitesR = SapI_sitesR + recfind(SapI_R, seq)
-
-	orgseq = seq
-	for site in BsaI_sitesF:
-		for i in range(3):
-			if (site % 3 == i):
-				seq = seq[:site] + BsaI_F_replace[i] + seq[site + 6:]
-	
-	for site in BsaI_sitesR:
-		for i in range(3):
-			if (site % 3 == i):
-				seq = seq[:site] + BsaI_R_replace[i] + seq[site + 6:]
-	
-	for site in SapI_sitesF:
-		for i in range(3):
-			if (site % 3 == i):
-				seq = seq[:site] + SapI_F_replace[i] + seq[site + 7:]
-				
-	for site in SapI_sitesR:
-		for i in range(3):
-			if (site % 3 == i):
-				seq = seq[:site] + SapI_R_replace[i] + seq[site + 7:]
-					
-	BsaI_sites = BsaI_sitesF+BsaI_sitesR
-	SapI_sites = SapI_sitesF+SapI_sitesR
-
-	return render_template('recode.html', dbid = dbid, seq = orgseq, seqType = seqType, BsaI = BsaI_sites, SapI=SapI_sites, newseq=seq, title='Recode sequence')
+	# Only the enzymes of the site index can be searched for
+	indexedEnzymes = [ enzyme.name for enzyme in siteScanner.enzymes ]
+	if not enzymes or any( not enzyme in indexedEnzymes for enzyme in enzymes ):
+		abort(400)
+
+	try:
+		maxSites = int(request.args.get('max', 0))
+		limit = max( min( int(request.args.get('limit', 1000)), 10000 ), 1 )
+	except ValueError:
+		abort(400)
+
+	marpodbSession = marpodb.Session()
+	parts = findPartsBySites(marpodbSession, part, enzymes, maxSites, scope, term, mode, limit)
+	marpodbSession.close()
+
+	return jsonify(part = part, enzymes = enzymes, max = maxSites, parts = parts)
 
 @app.route('/export/recode')
 def exportrecode():
@@ -436,6 +728,8 @@ def starGene():
 				newStar = StarGene(current_user.id, cdsdbid)
 				userDB.session.add(newStar)
 				userDB.session.commit()
+
+			sidebarCache.delete( sidebarKey() )
 		else:
 			if not "stars" in session:
 					session["stars"] = ""
@@ -464,12 +758,21 @@ def map():
 @app.route('/top')
 def top():
 
-	marpodbSession = marpodb.Session()
-	cdsTop = getTopGenes(marpodbSession, StarGene, 10)
-	marpodbSession.close()
+	cdsTop = topGenesCache.get(10)
+
+	if cdsTop is None:
+		marpodbSession = marpodb.Session()
+		cdsTop = getTopGenes(marpodbSession, StarGene, 10)
+		marpodbSession.close()
+
+		topGenesCache.set(10, cdsTop)
 
 	return render_template('top.html', list = cdsTop, title='Top genes')
 
+@app.route('/stats/cache')
+def cacheStats():
+	return jsonify(results = resultCache.stats(), sidebar = sidebarCache.stats(), top = topGenesCache.stats(), locus = locusCache.stats(), genbank = genbankCache.stats(), blast = blastCache.stats())
+
 @app.route('/about')
 def about():
 	return render_template("about.html", title='About')
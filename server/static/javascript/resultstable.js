@@ -0,0 +1,110 @@
+var rowCounter = $("#results-table tr.header").length;
+
+function queryParams(){
+	var table = $("#results-table");
+	return { term: table.attr('data-term'), scope: table.attr('data-scope'), mode: table.attr('data-mode') };
+}
+
+function newRow(level, pid, cols){
+	rowCounter += 1;
+
+	var row = $('<tr></tr>').addClass('header ' + level).attr('id', 'header' + rowCounter).attr('parent-id', pid);
+	var first = $('<td><span class="ident"></span></td>');
+
+	if (level != 'hit'){
+		first.append('<img src="../static/img/expand.png"/>');
+		first.append( $('<a target="_blank"></a>').attr('href', 'details?dbid=' + encodeURIComponent(cols[0])).text(cols[0]) );
+	}
+	else{
+		first.append( document.createTextNode(cols[0]) );
+	}
+	row.append(first);
+
+	for (var i = 1; i < cols.length; i++){
+		row.append( $('<td class="truncate"></td>').text(cols[i] === null ? '' : cols[i]) );
+	}
+
+	return row;
+}
+
+function closeRow(id){
+	$("[parent-id="+id+"]").each(function(i, selected){
+		closeRow( $(selected).attr('id') );
+	});
+
+	$("[id="+id+"]").attr('status', 'closed');
+	$("[id="+id+"] img").attr('src', '../static/img/expand.png');
+	$("[parent-id="+id+"]").attr('style','display: none');
+}
+
+function openRow(id){
+	$("[id="+id+"]").attr('status', 'open');
+	$("[id="+id+"] > td > img").attr('src', '../static/img/collapse.png');
+	$("[parent-id="+id+"]").attr('style','display: table-row');
+}
+
+function loadLocus(row, callback){
+	var params = $.extend({ dbid: row.attr('data-dbid') }, queryParams());
+
+	$.getJSON('/api/results/locus', params, function(data){
+		var rows = [];
+
+		$.each(data.genes, function(i, gene){
+			var geneRow = newRow('gene', row.attr('id'), gene.cols);
+			rows.push( geneRow.get(0) );
+
+			$.each(gene.parts, function(j, part){
+				var partRow = newRow('part', geneRow.attr('id'), part.cols);
+				rows.push( partRow.get(0) );
+
+				$.each(part.hits, function(k, hit){
+					rows.push( newRow('hit', partRow.attr('id'), hit).get(0) );
+				});
+			});
+		});
+
+		row.after(rows);
+		row.attr('loaded', 'true');
+		callback();
+	});
+}
+
+function loadMore(){
+	var table = $("#results-table");
+	var params = $.extend({ cursor: table.attr('data-cursor') }, queryParams());
+
+	$.getJSON('/api/results', params, function(data){
+		$.each(data.loci, function(i, locus){
+			var row = newRow('locus', 'headernone', locus.cols);
+			row.attr('data-dbid', locus.dbid);
+			table.find('tbody').append(row);
+		});
+
+		if (data.cursor){
+			table.attr('data-cursor', data.cursor);
+		}
+		else{
+			$("#more-results").remove();
+		}
+	});
+}
+
+$(document).on('click', '#results-table .header', function(){
+	var row = $(this);
+
+	if ( row.attr('status') == 'open' ){
+		closeRow(this.id);
+	}
+	else if ( row.hasClass('locus') && row.attr('loaded') != 'true' ){
+		var id = this.id;
+		loadLocus(row, function(){ openRow(id); });
+	}
+	else{
+		openRow(this.id);
+	}
+});
+
+$(document).on('click', '#more-results', function(){
+	loadMore();
+	return false;
+});
@@ -1,59 +1,122 @@
 from Bio.Seq import Seq
 from Bio.SeqRecord import SeqRecord
-from Bio.SeqFeature import SeqFeature, FeatureLocation, CompoundLocation
+from Bio.SeqFeature import SeqFeature
 from Bio.Alphabet import IUPAC
 from PIL import Image
 from io import StringIO
 
 import requests
 import json
+import re
 
-import collections
+import heapq
+import zipfile
+import csv
 
 from .tables import *
-from partsdb.tools.Exporters import GenBankExporter
-from sqlalchemy import or_
+from .coordinates import parseCoordinates, parseLocus, encodeCoordinates, decodeMany, decodeIntervals, intervalsToLocation, toLocation
+from .recoding import SiteScanner, defaultEnzymes, reverseComplement
+from sqlalchemy import or_, and_, func, exists, literal, select, bindparam, text
+from sqlalchemy.orm import joinedload
 
 def splitString(s,n):
 	return [s[ start:start+n ] for start in range(0, len(s), n) ]
 
-def recfind(pattern, string, where_should_I_start=0):
-    # Save the result in a variable to avoid doing the same thing twice
-    pos = string.find(pattern, where_should_I_start)
-    if pos == -1:
-        # Not found!
-        return []
-    # No need for an else statement
-    return [pos] + recfind(pattern, string, pos + len(pattern))
+def iterBlastHits(source, chunkSize = 65536):
+	# Walks the hits of an outfmt 15 report one at a time, reading the report
+	# in chunks from a file object, so that neither the document nor its
+	# text is ever held in memory at once. Strings and bytes are accepted too.
+	if isinstance(source, bytes):
+		source = source.decode('utf-8')
+	if isinstance(source, str):
+		source = StringIO(source)
+
+	buffer = ''
+	hits = None
+
+	# The header up to the hits array, which holds the query length
+	while hits is None:
+		chunk = source.read(chunkSize)
+		if not chunk:
+			return
+		buffer += chunk
+		hits = re.search(r'(?<!\\)"hits"\s*:\s*\[', buffer)
+
+	queryLen = re.search(r'(?<!\\)"query_len"\s*:\s*(\d+)', buffer[:hits.start()])
+	if not queryLen:
+		return
+
+	queryLen = int(queryLen.group(1))
+	decoder = json.JSONDecoder()
+	whitespace = re.compile(r'[\s,]*')
+
+	buffer = buffer[hits.end():]
+	exhausted = False
+
+	while True:
+		position = whitespace.match(buffer).end()
+
+		if position < len(buffer):
+			if buffer[position] == ']':
+				return
+			try:
+				hit, end = decoder.raw_decode(buffer, position)
+				yield queryLen, hit
+				buffer = buffer[end:]
+				continue
+			except ValueError:
+				# The hit runs on into the next chunk
+				if exhausted:
+					raise
+
+		if exhausted:
+			return
+
+		chunk = source.read(chunkSize)
+		if chunk:
+			buffer += chunk
+		else:
+			exhausted = True
+
+def getLocusDBIDs(session, dbids):
+	# Maps CDS and gene dbids to the dbids of their loci with one query per type
+	cdsDBIDs = [ dbid for dbid in dbids if 'cds' in dbid ]
+	geneDBIDs = [ dbid for dbid in dbids if 'gene' in dbid ]
+
+	loci = {}
+
+	if cdsDBIDs:
+		loci.update( session.query(CDS.dbid, Locus.dbid).filter(CDS.dbid.in_(cdsDBIDs)).filter( Gene.cdsID == CDS.id ).filter(Locus.id == Gene.locusID) )
+	if geneDBIDs:
+		loci.update( session.query(Gene.dbid, Locus.dbid).filter(Gene.dbid.in_(geneDBIDs)).filter(Gene.locusID == Locus.id) )
+
+	return loci
 
 def parseBlastResult(data, session, lineLenght = 60):
-	print("BLAST:")
-	# print data
-	blastResult = json.loads(data)
 	rows = []
 
-	for hit in blastResult["BlastOutput2"][0]["report"]["results"]["search"]["hits"]:
+	for queryLen, hit in iterBlastHits(data):
 		row = {}
 		title = hit["description"][0]["title"]
 		row["dbid"] = title.split()[0]
 
-		if 'cds' in row["dbid"]:
-			row['locusdbid'] = session.query(Locus.dbid).filter(CDS.dbid == row["dbid"]).filter( Gene.cdsID == CDS.id ).filter(Locus.id == Gene.locusID).first()[0]
-		elif 'gene' in row["dbid"]:
-			row['locusdbid'] = session.query(Locus.dbid).filter(Gene.dbid == row['dbid']).filter(Gene.locusID == Locus.id).first()[0]
 		row.update(hit["hsps"][0])
 
-		print("identity: ", row["identity"])
-		print("align_len: ", row["align_len"])
-
-		row["identity"] = "{0:.2f}".format(float(row["identity"]) / blastResult["BlastOutput2"][0]["report"]["results"]["search"]["query_len"])
-		row["coverage"] = "{0:.2f}".format( float(row["align_len"]-row["gaps"]) / blastResult["BlastOutput2"][0]["report"]["results"]["search"]["query_len"])
+		row["identity"] = "{0:.2f}".format(float(row["identity"]) / queryLen)
+		row["coverage"] = "{0:.2f}".format( float(row["align_len"]-row["gaps"]) / queryLen)
 
 		row["qseq"] = splitString(row["qseq"], lineLenght )
 		row["hseq"] = splitString(row["hseq"], lineLenght )
 		row["midline"] = [ s.replace(" ", "&nbsp") for s in splitString(row["midline"], lineLenght )]
 
 		rows.append(row)
+
+	loci = getLocusDBIDs(session, set( row["dbid"] for row in rows ))
+
+	for row in rows:
+		if row["dbid"] in loci:
+			row['locusdbid'] = loci[row["dbid"]]
+
 	return rows
 
 def generateNewMap(User):
@@ -103,29 +166,101 @@ def getColumnByName(cls, columnName):
 	return None
 
 
-def sortHits(hits, column, nHits):
-	sortedHits = sorted( hits, key = lambda x: x[column] )
-	return sortedHits[0:nHits+1]
+class WorstFirst(object):
+	# Inverts the ordering of a sort key, so that heapq keeps the worst
+	# retained hit at the root of the heap
+	__slots__ = ['key']
 
-def getGeneHomolog(marpodbSession, cdsDBID):
-	hits = marpodbSession.query(BlastpHit).\
-			filter(BlastpHit.targetID == CDS.id).\
-			filter(CDS.dbid == cdsDBID).all()
+	def __init__(self, key):
+		self.key = key
 
-	if hits:
-		hits.sort(key= lambda x: x.eVal)
-		return hits[0].proteinName
-	else:
-		return cdsDBID
+	def __lt__(self, other):
+		return self.key > other.key
+
+	def __eq__(self, other):
+		return self.key == other.key
+
+class TopHits(object):
+	# Bounded heap of the k best hits seen so far. Among equal keys the
+	# earliest hit wins, as it would with a stable sort.
+
+	def __init__(self, k):
+		self.k = k
+		self.heap = []
+		self.count = 0
+
+	def push(self, key, hit):
+		self.count += 1
+		entry = (WorstFirst(key), -self.count, hit)
+
+		if len(self.heap) < self.k:
+			heapq.heappush(self.heap, entry)
+		elif key < self.heap[0][0].key:
+			heapq.heapreplace(self.heap, entry)
+
+	def bestKey(self):
+		return min( entry[0].key for entry in self.heap )
+
+	def hits(self):
+		return [ entry[2] for entry in sorted( self.heap, key = lambda entry: (entry[0].key, -entry[1]) ) ]
+
+def cascadeForeignKey(connection, column):
+	# Tables created before their foreign key cascaded deletes get the
+	# constraint replaced, so that deleting a referenced row never fails
+	if connection.engine.dialect.name != 'postgresql':
+		return
+
+	name = '{0}_{1}_fkey'.format(column.table.name, column.name)
+	if connection.execute( text("SELECT 1 FROM pg_constraint WHERE conname = :name AND confdeltype = 'c'"), name = name ).first():
+		return
+
+	target = list(column.foreign_keys)[0].column
+	connection.execute( 'ALTER TABLE {0} DROP CONSTRAINT IF EXISTS "{1}", ADD CONSTRAINT "{1}" FOREIGN KEY ("{2}") REFERENCES {3} ({4}) ON DELETE CASCADE'.\
+							format(column.table.name, name, column.name, target.table.name, target.name) )
+
+def refreshBestHomologs(engine):
+	BestHomolog.__table__.create(engine, checkfirst = True)
+
+	connection = engine.connect()
+	transaction = connection.begin()
+
+	cascadeForeignKey(connection, BestHomolog.__table__.c.cdsID)
+
+	connection.execute( BestHomolog.__table__.delete() )
+
+	bestHits = select([BlastpHit.targetID, CDS.dbid, BlastpHit.uniID, BlastpHit.proteinName, BlastpHit.eVal]).\
+				where(BlastpHit.targetID == CDS.id).\
+				distinct(BlastpHit.targetID).\
+				order_by(BlastpHit.targetID, BlastpHit.eVal)
+
+	connection.execute( BestHomolog.__table__.insert().from_select(['cdsID', 'cdsDBID', 'uniID', 'proteinName', 'eVal'], bestHits) )
+
+	transaction.commit()
+	connection.close()
+
+def getGeneHomologs(marpodbSession, cdsDBIDs):
+	# Resolves the display names of many CDSs in one query, falling back to
+	# the dbid for CDSs without a BLASTp hit
+	homologs = { cdsDBID: cdsDBID for cdsDBID in cdsDBIDs }
+
+	if homologs:
+		for cdsDBID, proteinName in marpodbSession.query(BestHomolog.cdsDBID, BestHomolog.proteinName).\
+										filter(BestHomolog.cdsDBID.in_(list(homologs.keys()))):
+			homologs[cdsDBID] = proteinName
+
+	return homologs
 
 def getTopGenes(marpodbSession, StarGene, n):
 
-	cdsids = [star.cdsdbid for star in StarGene.query.all()]
-	topCDSScores = dict(collections.Counter(cdsids).most_common(n))
+	score = func.count(StarGene.id).label('score')
+	topCDS = StarGene.query.with_entities(StarGene.cdsdbid, score).\
+				group_by(StarGene.cdsdbid).\
+				order_by(score.desc(), StarGene.cdsdbid).\
+				limit(n).all()
 
-	topCDS = [ (cdsdbid, getGeneHomolog(marpodbSession, cdsdbid), topCDSScores[cdsdbid] ) for cdsdbid in list(topCDSScores.keys()) ]
-		
-	return sorted(topCDS, key = lambda x: x[2], reverse=True)
+	homologs = getGeneHomologs(marpodbSession, [ cdsdbid for cdsdbid, count in topCDS ])
+
+	return [ (cdsdbid, homologs[cdsdbid], count) for cdsdbid, count in topCDS ]
 
 def getUserData(StarGene, user, session, marpodbSession):
 	userData={}
@@ -137,38 +272,115 @@ def getUserData(StarGene, user, session, marpodbSession):
 			session["stars"] = ""
 		cdsIds = [i for i in session["stars"].split(':') if i]
 		
-	userData['starGenes'] = []
-
-	for cdsid in cdsIds:
-		homolog = getGeneHomolog(marpodbSession, cdsid)
-		userData['starGenes'].append( (cdsid, homolog ) )
+	homologs = getGeneHomologs(marpodbSession, cdsIds)
+	userData['starGenes'] = [ (cdsid, homologs[cdsid]) for cdsid in cdsIds ]
 
 	return userData
 
-def findDataIn(marpodbSession, level, table, queryColumns, equal, returnColumns):
+def searchDocument(cls):
+	# Full-text document over the searchable columns of an annotation table
+	document = None
+	for name in cls.__searchcolumns__:
+		column = func.coalesce(getColumnByName(cls, name), '')
+		document = column if document is None else document + ' ' + column
+
+	return func.to_tsvector('english', document)
+
+def refreshSearchDocuments(engine):
+	# Brings search_document in line with the annotation tables: documents of
+	# deleted hits are removed and only hits without a document are added
+	SearchDocument.__table__.create(engine, checkfirst = True)
+
+	connection = engine.connect()
+	transaction = connection.begin()
+
+	for cls in [BlastpHit, PfamHit]:
+		table = cls.__tablename__
+		tCls  = cls.__targetclass__
+		partColumn = getColumnByName(Gene, tCls.__tablename__+'ID')
+
+		connection.execute( SearchDocument.__table__.delete().\
+								where(SearchDocument.hitTable == table).\
+								where(~exists().where(cls.id == SearchDocument.hitID)) )
+
+		names = ['hitTable', 'hitID', 'level', 'locusDBID', 'geneDBID', 'partDBID', 'document']
+		values = [literal(table), cls.id, literal(tCls.__tablename__), Locus.dbid, Gene.dbid, tCls.dbid, searchDocument(cls)]
+
+		for column in SearchDocument.__table__.columns:
+			if not column.name in names and column.name != 'id' and getColumnByName(cls, column.name) is not None:
+				names.append(column.name)
+				values.append(getColumnByName(cls, column.name))
+
+		newHits = select(values).\
+					where(tCls.id == cls.targetID).\
+					where(partColumn == tCls.id).\
+					where(Locus.id == Gene.locusID).\
+					where(~exists().where(SearchDocument.hitTable == table).where(SearchDocument.hitID == cls.id))
+
+		connection.execute( SearchDocument.__table__.insert().from_select(names, newHits) )
+
+	transaction.commit()
+	connection.close()
+
+def createSearchIndexes(engine):
+	connection = engine.connect()
+	connection.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+	# Trigram indexes serve the unanchored ILIKE substring search
+	for cls in [BlastpHit, PfamHit]:
+		for name in cls.__searchcolumns__:
+			connection.execute('CREATE INDEX IF NOT EXISTS search_document_{0}_trgm ON search_document USING gin ("{1}" gin_trgm_ops)'.format(name.lower(), name))
+
+	connection.execute('CREATE INDEX IF NOT EXISTS search_document_fts ON search_document USING gin (document)')
+	connection.execute('ANALYZE search_document')
+
+	connection.close()
+
+def searchCondition(queryColumns, equal, mode):
+	# Returns the filter for a search term and the relevance expression used
+	# for ranking, which only exists for the full-text mode. Full-text
+	# matches are found through the indexed document of all columns, then
+	# kept only when the scoped columns together match, joined like the
+	# columns of the document.
+	if mode == 'fulltext':
+		tsQuery = func.plainto_tsquery('english', equal)
+
+		scoped = None
+		for qC in queryColumns:
+			column = func.coalesce(qC, '')
+			scoped = column if scoped is None else scoped + ' ' + column
+
+		scopedMatch = func.to_tsvector('english', scoped).op('@@')(tsQuery)
+		return and_( SearchDocument.document.op('@@')(tsQuery), scopedMatch ), func.ts_rank(SearchDocument.document, tsQuery).label('rank')
+	else:
+		return or_( qC.ilike('%'+equal+'%') for qC in queryColumns ), None
+
+def findDataIn(marpodbSession, level, table, queryColumns, equal, returnColumns, mode = 'substring', locusDBIDs = None):
+
+	queryColumns = [ getColumnByName(SearchDocument, name) for name in queryColumns ]
+	returnColumns = [ getColumnByName(SearchDocument, column.name) for column in returnColumns ]
 
-	cls 	= getClassByTablename(table)
-	tCls  = cls.__targetclass__
+	condition, rank = searchCondition(queryColumns, equal, mode)
 
-	queryColumns = [ getColumnByName(cls, name) for name in queryColumns ]
+	if rank is not None:
+		returnColumns = returnColumns + [ rank ]
 
-	query =  marpodbSession.query(tCls.id, tCls.dbid)
+	query =  marpodbSession.query(SearchDocument.locusDBID, SearchDocument.geneDBID, SearchDocument.partDBID)
 
 	for column in returnColumns:
 		query = query.add_columns(column)
 
-	targets = query.\
-				filter(tCls.id == cls.targetID).\
-				filter( or_( qC.ilike('%'+equal+'%') for qC in queryColumns ) ).all()
-	if targets:
-		return [  (levelID, levelDBID, cols) for levelID, levelDBID, cols in zip( [t[0] for t in targets], [t[1] for t in targets], [ {rc.name: x for rc, x in zip(returnColumns, t[2:]) } for t in targets ] )  ]
-	else:
-		return {}
+	query = query.\
+				filter(SearchDocument.hitTable == table).\
+				filter(SearchDocument.level == level).\
+				filter(condition)
 
+	if locusDBIDs is not None:
+		query = query.filter(SearchDocument.locusDBID.in_(locusDBIDs))
 
-def processQuery(marpodbSession, scope, term, columns, nHits):
+	return [ (t[0], t[1], t[2], {rc.name: x for rc, x in zip(returnColumns, t[3:]) }) for t in query ]
 
-	# Constructing display columns for the output table 
+def getDisplayColumns(scope, columns, mode):
 	displayTables = set( [x.split('.')[1] for x in scope] )
 
 	displayColumns = set()
@@ -176,10 +388,13 @@ def processQuery(marpodbSession, scope, term, columns, nHits):
 	for dt in displayTables:
 		displayColumns = displayColumns | set( [column.name for column in columns[dt]] )
 
-	displayColumns = list(displayColumns)
-	dcMap = { v:k for k, v in enumerate(displayColumns) }
+	if mode == 'fulltext':
+		displayColumns.add('rank')
+
+	# Sorted, so that every server process agrees on the column order
+	return sorted(displayColumns)
 
-	# Creating a scope map
+def getScopeDict(scope):
 	scopeDict = {}
 
 	for item in scope:
@@ -189,242 +404,511 @@ def processQuery(marpodbSession, scope, term, columns, nHits):
 
 		if not scLevel in scopeDict:
 			scopeDict[scLevel] = {}
+		if not scTable in scopeDict[scLevel]:
 			scopeDict[scLevel][scTable] = []
-			scopeDict[scLevel][scTable].append(scColumn)
-		elif not scTable in scopeDict[scLevel]:
-			scopeDict[scLevel][scTable] = []
-			scopeDict[scLevel][scTable].append(scColumn)
-		else:
-			scopeDict[scLevel][scTable].append(scColumn)
 
-	# Processing queries
-	loci = {}
+		scopeDict[scLevel][scTable].append(scColumn)
+
+	return scopeDict
+
+def getSortColumn(displayColumns, mode):
+	# Full-text hits are ranked by relevance, best first
+	if mode == 'fulltext':
+		return "rank", True
+	elif "eVal" in displayColumns:
+		return "eVal", False
+	else:
+		return "name", False
+
+def sortKey(value, reverse = False):
+	# Missing values go last regardless of the direction, numeric values
+	# are compared as floats
+	if value is None or value == '':
+		return (1, 0.0)
+	if isinstance(value, str):
+		return (0, value)
+	return (0, -float(value) if reverse else float(value))
+
+def scopeCondition(scope, term, mode = 'substring'):
+	# Filter matching the term in any column of the scope, with the relevance
+	# expression of the full-text mode
+	scopeDict = getScopeDict(scope)
+
+	conditions = []
+	rank = None
+
 	for scLevel in scopeDict:
 		for scTable in scopeDict[scLevel]:
+			queryColumns = [ getColumnByName(SearchDocument, name) for name in scopeDict[scLevel][scTable] ]
+			condition, rank = searchCondition(queryColumns, term, mode)
+			conditions.append( and_(SearchDocument.hitTable == scTable, SearchDocument.level == scLevel, condition) )
 
-			scColumns = scopeDict[scLevel][scTable]
+	return or_(*conditions), rank
 
-			print(scTable, scColumns)
+def rankLoci(marpodbSession, scope, term, columns, mode = 'substring'):
+	displayColumns = getDisplayColumns(scope, columns, mode)
+	sortCol, reverse = getSortColumn(displayColumns, mode)
 
-			newData = findDataIn(marpodbSession, scLevel, scTable, scColumns, term, columns[scTable])
+	condition, rank = scopeCondition(scope, term, mode)
 
-			print(newData)
+	if mode == 'fulltext':
+		aggregate = func.max(rank)
+	else:
+		aggregate = func.min(getColumnByName(SearchDocument, sortCol))
+
+	query = marpodbSession.query(SearchDocument.locusDBID, aggregate).\
+				filter(condition).\
+				group_by(SearchDocument.locusDBID)
+
+	best = { locusDBID: value for locusDBID, value in query }
+
+	return sorted( best, key = lambda locusDBID: ( sortKey(best[locusDBID], reverse), locusDBID ) )
+
+def getLociPage(rankedLoci, cursor, limit):
+	# The cursor is the dbid of the last locus of the previous page. An
+	# unknown cursor gets an empty final page rather than the first page.
+	limit = max(limit, 1)
+
+	start = 0
+	if cursor:
+		if not cursor in rankedLoci:
+			return [], None
+		start = rankedLoci.index(cursor) + 1
+
+	page = rankedLoci[start:start+limit]
+
+	if start + limit < len(rankedLoci):
+		return page, page[-1]
+	else:
+		return page, None
+
+def buildResultTree(marpodbSession, scope, term, columns, nHits, mode = 'substring', locusDBIDs = None):
+
+	# Constructing display columns for the output table 
+	displayColumns = getDisplayColumns(scope, columns, mode)
+	dcMap = { v:k for k, v in enumerate(displayColumns) }
+
+	scopeDict = getScopeDict(scope)
+
+	sortCol, reverse = getSortColumn(displayColumns, mode)
+	sortIndex = dcMap[sortCol]+1
+
+	# Processing queries in a single pass, keeping bounded top hits per node
+	loci = {}
+	for scLevel in scopeDict:
+		for scTable in scopeDict[scLevel]:
+
+			scColumns = scopeDict[scLevel][scTable]
+
+			newData = findDataIn(marpodbSession, scLevel, scTable, scColumns, term, columns[scTable], mode, locusDBIDs)
 
 			for hit in newData:
 
-				partID 		= hit[0]
-				partDBID	= hit[1]
-				cols 		= hit[2]
+				locusDBID 	= hit[0]
+				geneDBID 	= hit[1]
+				partDBID	= hit[2]
+				cols 		= hit[3]
 
 				fullCols = [''] * len(displayColumns)
 				
 				for col in cols:
 					fullCols[dcMap[col]] = cols[col]
 
-				
-				partColumn = getColumnByName(Gene, scLevel+'ID')
+				hitRow = [scTable] + fullCols
+				key = sortKey(hitRow[sortIndex], reverse)
 
-				locusDBID = marpodbSession.query(Locus.dbid).filter(Locus.id == Gene.locusID).\
-							filter(partColumn == partID).first()[0]
+				# Locus and gene rows only show their best hit, parts keep nHits+1
+				if not locusDBID in loci:
+					loci[locusDBID] = {"top": TopHits(1), "genes": {}}
+				locus = loci[locusDBID]
+				locus["top"].push(key, hitRow)
 
-				if locusDBID:
-					if not locusDBID in loci:
-						loci[locusDBID] = {"genes": {}}
+				if not geneDBID in locus["genes"]:
+					locus["genes"][geneDBID] = {"top": TopHits(1), "parts": {} }
+				gene = locus["genes"][geneDBID]
+				gene["top"].push(key, hitRow)
 
-					geneDBID = marpodbSession.query(Gene.dbid).filter(partColumn == partID).first()[0]
-					if geneDBID:
-						if not geneDBID in loci[locusDBID]["genes"]:
-							loci[locusDBID]["genes"][geneDBID] = {"parts": {} }
+				if not partDBID in gene["parts"]:
+					gene["parts"][partDBID] = {"top": TopHits(nHits+1) }
+				gene["parts"][partDBID]["top"].push(key, hitRow)
 
-						if not partDBID in loci[locusDBID]["genes"][geneDBID]["parts"]:
-							loci[locusDBID]["genes"][geneDBID]["parts"][partDBID] = {"hits": [] }
+	topRow = lambda dbid, node: [dbid] + node["top"].hits()[0][1:]
+	rowKey = lambda item: item[1]["top"].bestKey()
 
-						loci[locusDBID]["genes"][geneDBID]["parts"][partDBID]["hits"].append( [scTable] + fullCols )
+	tree = []
 
-	if "eVal" in dcMap:
-		sortCol = "eVal"
-	else:
-		sortCol = "name"
+	for locusDBID, locus in sorted( list(loci.items()), key = rowKey ):
+		genes = []
+		for geneDBID, gene in sorted( list(locus["genes"].items()), key = rowKey ):
+			parts = [ {"cols": topRow(partDBID, part), "hits": part["top"].hits()} for partDBID, part in sorted( list(gene["parts"].items()), key = rowKey ) ]
+			genes.append( {"cols": topRow(geneDBID, gene), "parts": parts} )
+		tree.append( {"dbid": locusDBID, "cols": topRow(locusDBID, locus), "genes": genes} )
 
+	return ["id"] + displayColumns, tree
 
-	for locusDBID, locus in loci.items():
-				# [	z for w in [ genes[gene]     ["trans"][x]["cds"]  [y]["hits"]          for x in genes[gene]     ["trans"]           for y in       genes[gene]     ["trans"][x]["cds"]                         ] for z in w]
-		allHits = [ z for w in [ locus["genes"][x]["parts"][y]["hits"] 	       for x in locus["genes"]           for y in       locus["genes"][x]["parts"]                       ] for z in w]
+def processLoci(marpodbSession, scope, term, columns, nHits, mode, locusDBIDs):
+	# Builds the result tree for the given loci only, keeping their order
+	header, tree = buildResultTree(marpodbSession, scope, term, columns, nHits, mode, locusDBIDs)
 
-		sortedHits = sortHits(allHits , dcMap[sortCol]+1, nHits)
-		locus["topRow"] = [locusDBID] + sortedHits[0][1:]
+	byDBID = { locus["dbid"]: locus for locus in tree }
 
-		# print locusDBID
+	return header, [ byDBID[locusDBID] for locusDBID in locusDBIDs if locusDBID in byDBID ]
 
-		for geneDBID, gene in locus["genes"].items():
-			# print "\t{0}".format(geneDBID)
-						# [z for w in [ genes[gene]["trans"][trans]["cds"][x]["hits"] for x in  genes[gene]["trans"][trans]["cds"]] for z in w ]
-			allHits =     [z for w in [ gene["parts"][x]["hits"] 		   					  for x in  gene["parts"]                             ] for z in w ]
-			sortedHits = sortHits(allHits, dcMap[sortCol]+1, nHits)
-			gene["topRow"] =  [geneDBID] + sortedHits[0][1:]
 
-			for partDBID, part in gene["parts"].items():
-				# print "\t\t{0}, {1}".format(partDBID, len(part["hits"]))
+def streamMatches(marpodbSession, scope, term, columns, mode = 'substring'):
+	# Every matching hit as a flat row, header first. The rows come from a
+	# server-side cursor, so the result set is never held in memory.
+	displayColumns = getDisplayColumns(scope, columns, mode)
+	condition, rank = scopeCondition(scope, term, mode)
 
-				sortedHits = sortHits( part["hits"], dcMap[sortCol]+1, nHits)
-				part["topRow"] = [partDBID] + sortedHits[0][1:]
-				part["hits"] = sortedHits
+	selected = [ rank if name == 'rank' else getColumnByName(SearchDocument, name) for name in displayColumns ]
 
-	table = {}
-	table["header"] = ["id"] + displayColumns
-	table["data"] = []
+	query = marpodbSession.query(SearchDocument.level, SearchDocument.hitTable, SearchDocument.locusDBID, SearchDocument.geneDBID, SearchDocument.partDBID, *selected).\
+				filter(condition).\
+				order_by(SearchDocument.locusDBID, SearchDocument.geneDBID, SearchDocument.partDBID, SearchDocument.id).\
+				execution_options(stream_results = True).\
+				yield_per(1000)
 
-	rowid = 0
+	yield ['level', 'table', 'locus', 'gene', 'part'] + displayColumns
 
-	lociList = sorted( list(loci.values()), key = lambda locus: locus["topRow"][dcMap[sortCol]+1] )
+	for row in query:
+		yield list(row)
 
-	for locus in lociList:
-		rowid += 1
-		locusid = rowid
+exportParts = {'cds': CDS, 'protein': CDS, 'promoter': Promoter, 'utr5': UTR5, 'utr3': UTR3, 'terminator': Terminator}
 
-		row = {"rowid": rowid, "pid": "none", "cols": locus["topRow"], "level" : "locus"}
-		table["data"].append(row)
+def streamSequences(marpodbSession, scope, term, part, mode = 'substring', lineLength = 60):
+	# FASTA records of one part type of every gene with a matching hit
+	cls = exportParts[part]
+	partColumn = getColumnByName(Gene, cls.__tablename__+'ID')
 
-		geneList = sorted( list(locus["genes"].values()), key = lambda gene: gene["topRow"][dcMap[sortCol]+1] )
+	condition, rank = scopeCondition(scope, term, mode)
+	matchedGenes = select([SearchDocument.geneDBID]).where(condition)
 
-		for gene in geneList:
-			rowid += 1
-			geneid = rowid
+	# Proteins are translated from the exons of the CDS, like getsequences.py
+	# does, so the coordinates come along with the sequence
+	columns = [Gene.dbid, cls.dbid, cls.seq]
+	if part == 'protein':
+		columns += [cls.packedCoordinates, cls.coordinates]
 
-			row = {"rowid": rowid, "pid": locusid, "cols": gene["topRow"], "level" : "gene"}
-			table["data"].append(row)
+	query = marpodbSession.query(*columns).\
+				filter(partColumn == cls.id).\
+				filter(Gene.dbid.in_(matchedGenes)).\
+				order_by(Gene.dbid).\
+				execution_options(stream_results = True).\
+				yield_per(1000)
 
-			partList = sorted( list(gene["parts"].values()), key = lambda part: part["topRow"][dcMap[sortCol]+1] )
+	for row in query:
+		geneDBID, partDBID, seq = row[:3]
+		if not seq:
+			continue
+		if part == 'protein':
+			packed, coordinates = row[3:]
+			if packed:
+				location = toLocation(packed)
+			else:
+				location = intervalsToLocation( parseCoordinates(coordinates) )
+			if location is None:
+				continue
+			seq = str( SeqFeature(location = location).extract( Seq(seq) ).translate() )
 
-			for part in partList:
-				rowid += 1
-				partid = rowid
+		yield ">{0} {1}\n{2}\n".format(partDBID, geneDBID, "\n".join( splitString(seq, lineLength) ))
 
-				row = {"rowid": rowid, "pid": geneid, "cols": part["topRow"], "level" : "part"}
-				table["data"].append(row)
+class LineBuffer(object):
+	# Lets csv.writer return its lines instead of writing them anywhere
+	def write(self, line):
+		return line
 
-				for hit in part["hits"]:
-					rowid += 1
-					row = {"rowid": rowid, "pid": partid, "cols": hit, "level" : "hit"}
-					table["data"].append(row)
-	return table
+def csvLines(rows):
+	writer = csv.writer( LineBuffer() )
+	for row in rows:
+		yield writer.writerow(row)
 
+siteParts = {'promoter': Promoter, 'utr5': UTR5, 'cds': CDS, 'utr3': UTR3, 'terminator': Terminator}
 
-	# Sorting the table
-	for gene in genes:
-		allHits = genes[gene]["hits"] + [z for w in [ genes[gene]["trans"][x]["hits"] for x in genes[gene]["trans"] ] for z in w] + [z for w in [ genes[gene]["trans"][x]["cds"][y]["hits"] for x in genes[gene]["trans"] for y in genes[gene]["trans"][x]["cds"] ] for z in w]
-		sortedHits = sortHits(allHits , dcMap[sortCol]+1, nHits)
-		genes[gene]["topRow"] = [gene] + sortedHits[0][1:]
+def refreshPartSites(engine, enzymes = defaultEnzymes, batchSize = 10000):
+	# Rebuilds the site index of all parts for the given enzymes
+	PartSite.__table__.create(engine, checkfirst = True)
 
+	scanner = SiteScanner(enzymes)
 
-		genes[gene]["hits"] = sortHits(genes[gene]["hits"], dcMap[sortCol]+1, nHits)
+	connection = engine.connect()
+	transaction = connection.begin()
 
-		for trans in genes[gene]["trans"]:
-			allHits = genes[gene]["trans"][trans]["hits"] + [z for w in [ genes[gene]["trans"][trans]["cds"][x]["hits"] for x in  genes[gene]["trans"][trans]["cds"]] for z in w ]
-			sortedHits = sortHits(allHits, dcMap[sortCol]+1, nHits)
-			genes[gene]["trans"][trans]["topRow"] = [trans] + sortedHits[0][1:]
+	connection.execute( PartSite.__table__.delete() )
 
-			genes[gene]["trans"][trans]["hits"] = sortHits(genes[gene]["trans"][trans]["hits"], dcMap[sortCol]+1, nHits)
+	rows = []
+	for table, cls in siteParts.items():
+		parts = select([cls.id, cls.dbid, cls.seq]).execution_options(stream_results = True)
+
+		for partID, partDBID, seq in connection.execute(parts):
+			for position, enzymeIndex, strand in scanner.scan(seq or ''):
+				rows.append( {'partTable': table, 'partID': partID, 'partDBID': partDBID, 'enzyme': enzymes[enzymeIndex].name, 'strand': strand, 'position': position} )
+
+			if len(rows) >= batchSize:
+				connection.execute(PartSite.__table__.insert(), rows)
+				rows = []
+
+	if rows:
+		connection.execute(PartSite.__table__.insert(), rows)
+
+	transaction.commit()
+	connection.close()
+
+def findPartsBySites(marpodbSession, part, enzymes, maxSites = 0, scope = None, term = None, mode = 'substring', limit = 1000):
+	# Parts of one type with at most maxSites sites of the given enzymes,
+	# optionally only those of genes matching a search, e.g. the promoters of
+	# MYB genes without BsaI or SapI sites
+	cls = siteParts[part]
+	partColumn = getColumnByName(Gene, part+'ID')
+	limit = max(limit, 1)
+
+	siteCount = select([func.count(PartSite.id)]).\
+					where(PartSite.partTable == part).\
+					where(PartSite.partID == cls.id).\
+					where(PartSite.enzyme.in_(enzymes)).\
+					as_scalar()
+
+	query = marpodbSession.query(Gene.dbid, cls.dbid, siteCount.label('sites')).\
+				filter(partColumn == cls.id)
+
+	if maxSites == 0:
+		query = query.filter( ~exists().where(and_(PartSite.partTable == part, PartSite.partID == cls.id, PartSite.enzyme.in_(enzymes))) )
+	else:
+		query = query.filter(siteCount <= maxSites)
+
+	if scope and term:
+		condition, rank = scopeCondition(scope, term, mode)
+		query = query.filter( Gene.dbid.in_(select([SearchDocument.geneDBID]).where(condition)) )
+
+	return [ {'gene': geneDBID, 'part': partDBID, 'sites': sites} for geneDBID, partDBID, sites in query.order_by(Gene.dbid).limit(limit) ]
+
+def resolveDBID(marpodbSession, dbid):
+	# Finds out in one query whether dbid is a locus, gene or CDS, returning
+	# its type, id and the id of its locus
+	loci  = marpodbSession.query(literal('locus').label('type'), Locus.id.label('id'), Locus.id.label('locusID')).filter(Locus.dbid == dbid)
+	genes = marpodbSession.query(literal('gene').label('type'), Gene.id.label('id'), Gene.locusID.label('locusID')).filter(Gene.dbid == dbid)
+	cdss  = marpodbSession.query(literal('cds').label('type'), CDS.id.label('id'), Gene.locusID.label('locusID')).filter(CDS.dbid == dbid).filter(Gene.cdsID == CDS.id)
+
+	return loci.union_all(genes, cdss).first()
+
+def geneQuery(marpodbSession):
+	# Genes with all their parts, loaded in a single joined query
+	return marpodbSession.query(Gene).\
+				options( joinedload(Gene.promoter), joinedload(Gene.utr5), joinedload(Gene.cds),\
+						joinedload(Gene.utr3), joinedload(Gene.terminator), joinedload(Gene.locus) )
+
+def getLocusGenes(marpodbSession, locusid):
+	# All gene models of a locus with their parts
+	return geneQuery(marpodbSession).filter(Gene.locusID == locusid).order_by(Gene.id).all()
+
+def getGenes(marpodbSession, geneDBIDs):
+	return geneQuery(marpodbSession).filter(Gene.dbid.in_(geneDBIDs)).all()
+
+def getRecodeSequence(gene, seqType):
+	# Sequence of a gene that can be recoded, None when the gene lacks it
+	if seqType == 'cds':
+		return gene.cds.seq if gene.cds else None
+	elif seqType == 'promoter':
+		return gene.promoter.seq if gene.promoter else None
+	elif seqType == 'promoter5':
+		if not gene.promoter:
+			return None
+		return gene.promoter.seq + (gene.utr5.seq if gene.utr5 else '')
+	return None
 
-			for cds in genes[gene]["trans"][trans]["cds"]:
-				sortedHits = sortHits(genes[gene]["trans"][trans]["cds"][cds]["hits"], dcMap[sortCol]+1, nHits)
-				genes[gene]["trans"][trans]["cds"][cds]["topRow"] = [cds] + sortedHits[0][1:]
-				genes[gene]["trans"][trans]["cds"][cds]["hits"] = sortedHits
+def getStarredGeneDBIDs(marpodbSession, cdsDBIDs):
+	# Stars are kept by CDS, exports work on whole genes
+	if not cdsDBIDs:
+		return []
 
-	geneList = sorted(list(genes.values()), key = lambda gene: gene["topRow"][dcMap[sortCol]+1])
-	
-	# Generating output table
-	table = {}
-	table['header'] = ['id'] + displayColumns
-	table['data'] = []
-	
-	rowid = 0
+	return [ geneDBID for geneDBID, in marpodbSession.query(Gene.dbid).filter(Gene.cdsID == CDS.id, CDS.dbid.in_(cdsDBIDs)).order_by(Gene.dbid) ]
 
-	for gene in geneList:
-		rowid += 1
-		geneid = rowid
+geneParts = ['promoter', 'utr5', 'cds', 'utr3', 'terminator']
 
-		row = {"rowid": rowid, "pid": "none", "cols": gene["topRow"], "level" : "gene"}
-		table["data"].append(row)
+def packedCoordinates(part):
+	# Parts loaded before their coordinates were packed fall back to the text
+	if part.packedCoordinates is not None:
+		return part.packedCoordinates
+	return encodeCoordinates( parseCoordinates(part.coordinates) )
 
-		for hit in gene["hits"]:
-			rowid += 1
-			row = {"rowid": rowid, "pid": geneid, "cols": hit, "level" : "hit"}
-			table["data"].append(row)
+def getGeneCoordinates(genes):
+	# Feature coordinates of every gene as laid out by GenBankExporter, each
+	# part following the previous one, computed from the packed coordinates
+	# of all exon parts decoded at once
+	exonParts = [ getattr(gene, key) for gene in genes for key in geneParts if key in ('utr5', 'cds', 'utr3') and getattr(gene, key) ]
+	values, offsets = decodeMany( [ packedCoordinates(part) for part in exonParts ] )
+	exonIndex = { id(part): i for i, part in enumerate(exonParts) }
 
-		for trans in gene["trans"]:
-			rowid += 1
-			transid = rowid
+	response = {}
+	response['genes'] = {}
 
-			row = {"rowid": rowid, "pid": geneid, "cols": gene["trans"][trans]["topRow"], "level" : "trans"}
-			table["data"].append(row)
+	for gene in genes:
+		features = {}
+		seq = ''
+
+		for key in geneParts:
+			part = getattr(gene, key)
+			if not part:
+				continue
+
+			shift = len(seq)
+			if id(part) in exonIndex:
+				i = exonIndex[id(part)]
+				intervals = [ values[row] for row in range(offsets[i], offsets[i+1]) ]
+			else:
+				intervals = [ (0, len(part.seq or '')) ]
 
-			for hit in gene["trans"][trans]["hits"]:
-				rowid += 1
-				row = {"rowid": rowid, "pid": transid, "cols": hit, "level" : "hit"}
-				table["data"].append(row)
+			features[part.dbid] = ";".join([ "{0}:{1}".format(interval[0] + shift, interval[1] + shift) for interval in intervals ])
+			seq += part.seq or ''
 
-			for cds in gene["trans"][trans]["cds"]:
-				rowid += 1
-				cdsid = rowid
-				row = {"rowid": rowid, "pid": transid, "cols": gene["trans"][trans]["cds"][cds]["topRow"], "level" : "cds"}
-				table["data"].append(row)
+		response['genes'][gene.dbid] = {'strand' : gene.locusStrand, 'features' : features}
 
-				for hit in gene["trans"][trans]["cds"][cds]["hits"]:
-					rowid += 1
-					row = {"rowid": rowid, "pid": cdsid, "cols": hit, "level" : "hit"}
-					table["data"].append(row)
+		if not 'seq' in response:
+			response['seq'] = seq if gene.locusStrand == 1 else reverseComplement(seq)
 
-	return table
+	return response
 
+def getLocusPayload(genes):
+	# Plain, cacheable version of everything the details page needs from a
+	# locus, so that cached views skip the GenBank export altogether
+	response = getGeneCoordinates(genes)
 
-def getGeneCoordinates(marpodbSession, locusid):
-	
-	genes = marpodbSession.query(Gene).filter(Gene.locusID == locusid).all()
+	models = [ {'id': gene.id, 'dbid': gene.dbid, 'cdsID': gene.cdsID, 'cdsDBID': gene.cds.dbid if gene.cds else None} for gene in genes ]
 
-	exporter = GenBankExporter(None)
+	return {'genes': response['genes'], 'seq': response.get('seq', ''), 'models': models}
 
+def parseHSPs(coordinates):
+	# Legacy "qs:qe,ts:te,pident;" encoding of BlastpHit.coordinates
+	hsps = []
+	for tab in (coordinates or '').split(';'):
+		if not tab:
+			continue
+		query, target, pident = tab.split(',')
+		qStart, qEnd = query.split(':')
+		tStart, tEnd = target.split(':')
+		hsps.append( [int(qStart), int(qEnd), int(tStart), int(tEnd), float(pident)] )
 
-	response = {}
-	
-	response['genes'] = {}
+	return hsps
 
-	for gene in genes:
-		record =  exporter.export(gene, None)
-		response['genes'][record.id] = {'strand' : gene.locusStrand, 'features' : {}}
+def refreshBlastpHSPs(engine):
+	# Moves the coordinates of hits that have no HSP rows yet into blastp_hsp
+	BlastpHSP.__table__.create(engine, checkfirst = True)
+
+	connection = engine.connect()
+	transaction = connection.begin()
 
-		for feature in record.features:
+	cascadeForeignKey(connection, BlastpHSP.__table__.c.hitID)
+
+	hits = select([BlastpHit.id, BlastpHit.coordinates]).\
+				where(~exists().where(BlastpHSP.hitID == BlastpHit.id))
+
+	rows = []
+	for hitID, coordinates in connection.execute(hits):
+		for qStart, qEnd, tStart, tEnd, pident in parseHSPs(coordinates):
+			rows.append( {'hitID': hitID, 'qStart': qStart, 'qEnd': qEnd, 'tStart': tStart, 'tEnd': tEnd, 'pident': pident} )
+
+		if len(rows) >= 10000:
+			connection.execute(BlastpHSP.__table__.insert(), rows)
+			rows = []
+
+	if rows:
+		connection.execute(BlastpHSP.__table__.insert(), rows)
+
+	transaction.commit()
+	connection.close()
+
+class StreamBuffer(object):
+	# Write-only file that hands its content over on every drain, so that a
+	# zip archive can be streamed while it is written
+	def __init__(self):
+		self.chunks = []
+
+	def write(self, data):
+		self.chunks.append( bytes(data) )
+		return len(data)
+
+	def flush(self):
+		pass
+
+	def drain(self):
+		data = b''.join(self.chunks)
+		self.chunks = []
+		return data
+
+def zipStream(entries):
+	# Yields the bytes of a zip archive of (name, text) entries as they come
+	buffer = StreamBuffer()
+	archive = zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED)
+
+	for name, text in entries:
+		archive.writestr(name, text)
+		yield buffer.drain()
+
+	archive.close()
+	yield buffer.drain()
+
+def packCoordinates(engine, batchSize = 10000):
+	# Packs the text coordinates of the rows that have no packed value yet,
+	# e.g. rows loaded by partsdb, and adds the column to databases created
+	# before it. Rows with unreadable coordinates stay unpacked.
+	for cls in [Locus, UTR5, CDS, UTR3, PfamHit]:
+		table = cls.__table__
+		table.create(engine, checkfirst = True)
+
+		connection = engine.connect()
+		transaction = connection.begin()
+
+		if engine.dialect.name == 'postgresql':
+			connection.execute( text('ALTER TABLE {0} ADD COLUMN IF NOT EXISTS "packedCoordinates" BYTEA'.format(table.name)) )
+
+		parse = (lambda coordinates: parseLocus(coordinates)[1]) if cls is Locus else parseCoordinates
+		update = table.update().where(table.c.id == bindparam('rowID')).values(packedCoordinates = bindparam('packed'))
+
+		# Rows are read through a second connection, so that the server-side
+		# cursor stays open while the updates are written
+		reader = engine.connect()
+		rows = reader.execution_options(stream_results = True).execute( select([table.c.id, table.c.coordinates]).\
+					where(table.c.packedCoordinates == None).\
+					where(table.c.coordinates != None) )
+
+		values = []
+		skipped = 0
+		for rowID, coordinates in rows:
 			try:
-				locations = feature.location.parts
-			except:
-				locations = [feature.location]
+				values.append( {'rowID': rowID, 'packed': encodeCoordinates(parse(coordinates))} )
+			except ValueError:
+				skipped += 1
+				continue
 
-	
-			coordinates = ";".join([ "{0}:{1}".format(part.start, part.end) for part in locations  ])
+			if len(values) >= batchSize:
+				connection.execute(update, values)
+				values = []
 
-			response['genes'][record.id]['features'][feature.id] = coordinates
-		
-		if not 'seq' in response:
-			print('Sequence of ', record.id)
-			if response['genes'][record.id]['strand'] == 1:
-				response['seq'] = record.seq
-			else:
-				response['seq'] = record.seq.reverse_complement()
-	
-	return response
+		if values:
+			connection.execute(update, values)
+
+		reader.close()
+		transaction.commit()
+		connection.close()
+
+		if skipped:
+			print("Skipped {0} rows of {1} with invalid coordinates".format(skipped, table.name))
 
 def getBlastpHits(marpodbSession, cdsDBID):
 	returnTable = {'rows' : [], 'maxLen' : -1}
-	hits = marpodbSession.query(BlastpHit).filter(BlastpHit.targetID==CDS.id).filter(CDS.dbid == cdsDBID).all()
+	hits = marpodbSession.query(BlastpHit).filter(BlastpHit.targetID==CDS.id).filter(CDS.dbid == cdsDBID).order_by(BlastpHit.eVal).all()
 
 	if hits:
+		coordinates = { hit.id: [] for hit in hits }
+
+		hsps = marpodbSession.query(BlastpHSP.hitID, BlastpHSP.qStart, BlastpHSP.qEnd, BlastpHSP.tStart, BlastpHSP.tEnd, BlastpHSP.pident).\
+						filter(BlastpHSP.hitID.in_(list(coordinates.keys()))).\
+						order_by(BlastpHSP.hitID, BlastpHSP.id)
+
+		for hitID, qStart, qEnd, tStart, tEnd, pident in hsps:
+			coordinates[hitID].append( [qStart, qEnd, tStart, tEnd, pident] )
+
 		for hit in hits:
-			coordinateString = hit.coordinates
-			tabs = coordinateString.split(';')[:-1]
-			print(tabs)
-			coordinates = [  [int(tab.split(',')[0].split(':')[0]), int(tab.split(',')[0].split(':')[1]),\
-											int(tab.split(',')[1].split(':')[0]), int(tab.split(',')[1].split(':')[1]),\
-												float(tab.split(',')[2])] for tab in tabs ]
 			returnTable["maxLen"] = max(returnTable["maxLen"], hit.tLen)
 			
 			row = {}
@@ -434,16 +918,20 @@ def getBlastpHits(marpodbSession, cdsDBID):
 			row['proteinName'] = hit.proteinName
 			row['origin'] = hit.origin
 			row['eVal'] = hit.eVal
-			row['coordinates'] = coordinates
+			row['coordinates'] = coordinates[hit.id]
 
 			returnTable['rows'].append(row)
 
 		returnTable['maxLen'] = max(returnTable["maxLen"], hits[0].qLen)
-	
-	returnTable['rows'].sort(key =lambda x: x['eVal'])
 
 	return returnTable
 
+def getHitsCoveringResidue(marpodbSession, cdsDBID, residue):
+	# BLASTp hits of a CDS with at least one HSP spanning the query residue
+	return marpodbSession.query(BlastpHit).\
+				filter(BlastpHit.targetID == CDS.id, CDS.dbid == cdsDBID).\
+				filter( exists().where(and_(BlastpHSP.hitID == BlastpHit.id, BlastpHSP.qStart <= residue, BlastpHSP.qEnd >= residue)) ).\
+				order_by(BlastpHit.eVal).all()
 
 def getCDSDetails(marpodbSession, cdsDBID):
 
@@ -469,32 +957,19 @@ def exportGB(cur, cdsName):
 
 	record = SeqRecord( Seq( geneSeq[0], IUPAC.unambiguous_dna ), name = geneName, description = "Generated by MarpoDB", id=cdsName )
 
-	cur.execute("SELECT coordinates FROM cds WHERE name=%s", (cdsName,))
+	cur.execute('SELECT "packedCoordinates", coordinates FROM cds WHERE name=%s', (cdsName,))
 	cdsCoordinates = cur.fetchone()
 
-	print(cdsCoordinates)
-
-	if not( cdsCoordinates and cdsCoordinates[0] ):
+	if not( cdsCoordinates and (cdsCoordinates[0] or cdsCoordinates[1]) ):
 		return None
 
-	cdsLocations = []
-
-	cdsString = cdsCoordinates[0].split(';')
-	print(cdsString)
-	for part in cdsString:
-		tabs = part.split(',')
-		start = int(tabs[0])-1
-		end = 	int(tabs[1])
-		strand = 1 if tabs[2]=='+' else -1
-
-		print(start, end, strand)
-
-		cdsLocations.append( FeatureLocation(start, end, strand = strand) )
-	
-	if len(cdsLocations) > 1:
-		location = CompoundLocation(cdsLocations)
+	if cdsCoordinates[0]:
+		intervals = decodeIntervals( bytes(cdsCoordinates[0]) )
 	else:
-		location = cdsLocations[0]
+		intervals = parseCoordinates(cdsCoordinates[1])
+
+	strand = 1 if intervals[-1][2] == 1 else -1
+	location = intervalsToLocation(intervals)
 
 	record.features.append( SeqFeature( location = location, strand = strand, type='CDS', id=transcriptName ) )
 
@@ -504,21 +979,7 @@ def exportGB(cur, cdsName):
 	if not transcriptCoordinates:
 		return None
 
-	exons = []
-
-	
-	exonStrings = transcriptCoordinates[0].split(';')
-	for exon in exonStrings:
-		tabs = exon.split(',')
-		start = int(tabs[0])-1
-		end = int(tabs[1])
-
-		exons.append( FeatureLocation(start, end, strand = strand) )
-
-	if len(exons) > 1:
-		location = CompoundLocation(exons)
-	else:
-		location = exons[0]
+	location = intervalsToLocation( parseCoordinates(transcriptCoordinates[0]), strand )
 
 	record.features.append( SeqFeature( location = location, strand = strand, type = 'mRNA', id=cdsName ) )
 	return record
@@ -1,23 +1,25 @@
 from sqlalchemy.ext.declarative import declared_attr
-from sqlalchemy import Column, Integer, String, ForeignKey, Text, Float
+from sqlalchemy import Column, Integer, String, ForeignKey, Text, Float, LargeBinary, UniqueConstraint, Index
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.orm import relationship
 from partsdb.system.Tables import Base, BaseMixIn, PartMixIn, ExonMixIn, AnnotationMixIn
 from partsdb.tools.Annotators import BlastAnnotator, PfamAnnotator
 
 class Locus(Base, BaseMixIn):
 	coordinates 	= Column( Text )
+	packedCoordinates = Column( LargeBinary )
 
 class Promoter(Base,BaseMixIn,PartMixIn):
 	pass
 
 class UTR5(Base,BaseMixIn,PartMixIn, ExonMixIn):
-	pass
+	packedCoordinates = Column( LargeBinary )
 
 class CDS(Base,BaseMixIn,PartMixIn, ExonMixIn):
-	pass
+	packedCoordinates = Column( LargeBinary )
 
 class UTR3(Base,BaseMixIn,PartMixIn, ExonMixIn):
-	pass
+	packedCoordinates = Column( LargeBinary )
 
 class Terminator(Base,BaseMixIn,PartMixIn):
 	pass
@@ -44,6 +46,7 @@ class BlastpHit(Base, BaseMixIn, AnnotationMixIn):
 
 	__targetclass__ = CDS
 	__annotatorclass__ = BlastAnnotator
+	__searchcolumns__ = ['proteinName', 'geneName', 'origin']
 
 	uniID 			= Column( String(100) )
 	coverage		= Column( Float )
@@ -59,10 +62,72 @@ class PfamHit(Base, BaseMixIn, AnnotationMixIn):
 
 	__targetclass__ = CDS
 	__annotatorclass__ = PfamAnnotator
+	__searchcolumns__ = ['name', 'acc', 'description']
 
 	name 			= Column( String(100) )
 	acc 			= Column( String(100) )
 	eVal 			= Column( Float )
 	cVal 			= Column( Float )
 	description 	= Column( Text )
-	coordinates		= Column( Text )
\ No newline at end of file
+	coordinates		= Column( Text )
+	packedCoordinates = Column( LargeBinary )
+
+class SearchDocument(Base):
+	# Denormalised copy of every annotation hit with the dbids of its part,
+	# gene and locus, so that searching does not need any joins
+	__tablename__ = 'search_document'
+	__table_args__ = ( UniqueConstraint('hitTable', 'hitID', 'geneDBID'), )
+
+	id 				= Column( Integer, primary_key = True )
+	hitTable 		= Column( String(100), index = True )
+	hitID 			= Column( Integer )
+	level 			= Column( String(100) )
+	locusDBID 		= Column( String(100), index = True )
+	geneDBID 		= Column( String(100) )
+	partDBID 		= Column( String(100) )
+	eVal 			= Column( Float )
+	name 			= Column( String(100) )
+	acc 			= Column( String(100) )
+	description 	= Column( Text )
+	proteinName 	= Column( Text )
+	geneName 		= Column( Text )
+	origin 			= Column( Text )
+	document 		= Column( TSVECTOR )
+
+class BestHomolog(Base):
+	# Lowest e-value BLASTp hit of every CDS, precomputed at annotation time
+	__tablename__ = 'best_homolog'
+
+	id 				= Column( Integer, primary_key = True )
+	cdsID 			= Column( Integer, ForeignKey('cds.id', ondelete = 'CASCADE'), unique = True )
+	cdsDBID 		= Column( String(100), unique = True )
+	uniID 			= Column( String(100) )
+	proteinName 	= Column( Text )
+	eVal 			= Column( Float )
+
+class BlastpHSP(Base):
+	# One row per HSP of a BLASTp hit, so that coordinates can be loaded and
+	# queried without parsing BlastpHit.coordinates
+	__tablename__ = 'blastp_hsp'
+
+	id 				= Column( Integer, primary_key = True )
+	hitID 			= Column( Integer, ForeignKey(BlastpHit.__table__.c.id, ondelete = 'CASCADE'), index = True )
+	qStart 			= Column( Integer )
+	qEnd 			= Column( Integer )
+	tStart 			= Column( Integer )
+	tEnd 			= Column( Integer )
+	pident 			= Column( Float )
+
+class PartSite(Base):
+	# Type IIS recognition sites of every part, computed when loading, so that
+	# parts can be selected by their sites without scanning sequences
+	__tablename__ = 'part_site'
+	__table_args__ = ( Index('ix_part_site_part', 'partTable', 'partID', 'enzyme'), )
+
+	id 				= Column( Integer, primary_key = True )
+	partTable 		= Column( String(100) )
+	partID 			= Column( Integer )
+	partDBID 		= Column( String(100), index = True )
+	enzyme 			= Column( String(100) )
+	strand 			= Column( Integer )
+	position 		= Column( Integer )
@@ -0,0 +1,65 @@
+import time
+
+from server.cache import LRUCache, DiskCache, ResultCache, createCache, bumpDataVersion, dataVersion
+
+def test_lru_evicts_least_recently_used():
+	cache = LRUCache(2)
+	cache.set('a', 1)
+	cache.set('b', 2)
+	cache.get('a')
+	cache.set('c', 3)
+
+	assert cache.get('a') == 1
+	assert cache.get('b') is None
+	assert cache.get('c') == 3
+	assert len(cache) == 2
+
+def test_disk_cache_round_trip_and_eviction(tmp_path):
+	cache = DiskCache(str(tmp_path / 'cache'), maxSize = 2)
+	cache.set(('loci', 'kinase'), [1, 2, 3])
+	assert cache.get(('loci', 'kinase')) == [1, 2, 3]
+
+	cache.delete(('loci', 'kinase'))
+	assert cache.get(('loci', 'kinase')) is None
+
+	for i in range(5):
+		cache.set(i, i)
+	assert len(cache) == 2
+
+def test_disk_cache_is_shared_between_instances(tmp_path):
+	DiskCache(str(tmp_path)).set('key', 'value')
+	assert DiskCache(str(tmp_path)).get('key') == 'value'
+
+def test_version_bump_invalidates_entries(tmp_path):
+	versionFileName = str(tmp_path / 'data' / 'version')
+	bumpDataVersion(versionFileName)
+
+	cache = ResultCache(LRUCache(), versionFileName)
+	cache.set('key', 'value')
+	assert cache.get('key') == 'value'
+
+	time.sleep(0.01)
+	bumpDataVersion(versionFileName)
+	assert cache.get('key') is None
+	assert cache.stats()['version'] == dataVersion(versionFileName)
+
+def test_ttl_expires_entries(tmp_path):
+	cache = ResultCache(LRUCache(), str(tmp_path / 'version'), ttl = 0.05)
+	cache.set('key', 'value')
+	assert cache.get('key') == 'value'
+
+	time.sleep(0.1)
+	assert cache.get('key') is None
+	assert cache.stats()['hits'] == 1
+	assert cache.stats()['misses'] == 1
+
+def test_create_cache_picks_backend(tmp_path, monkeypatch):
+	monkeypatch.delenv('MARPODB_CACHE_DIR', raising = False)
+	local = createCache('sidebar', 16, localTTL = 5)
+	assert isinstance(local.backend, LRUCache)
+	assert local.ttl == 5
+
+	monkeypatch.setenv('MARPODB_CACHE_DIR', str(tmp_path))
+	shared = createCache('sidebar', 16, localTTL = 5)
+	assert isinstance(shared.backend, DiskCache)
+	assert shared.ttl is None
@@ -0,0 +1,43 @@
+import pytest
+
+coordinates = pytest.importorskip('server.coordinates')
+
+def test_parse_formats():
+	# partsdb, cutGenes.py parts and exon-only coordinates
+	assert coordinates.parseCoordinates('0,50,1;60,80,1') == [(0, 50, 1), (60, 80, 1)]
+	assert coordinates.parseCoordinates('1,50,+;60,80,-') == [(0, 50, 1), (59, 80, -1)]
+	assert coordinates.parseCoordinates('1,50;60,80') == [(0, 50, 0), (59, 80, 0)]
+	assert coordinates.parseCoordinates('') == []
+	assert coordinates.parseCoordinates(None) == []
+
+def test_parse_locus():
+	assert coordinates.parseLocus('scaffold_1:100-200') == ('scaffold_1', [(100, 200, 0)])
+	assert coordinates.parseLocus('scaffold_1:101:200') == ('scaffold_1', [(100, 200, 0)])
+
+	with pytest.raises(ValueError):
+		coordinates.parseLocus('scaffold_1')
+
+def test_encode_decode_round_trip():
+	intervals = [(0, 50, 1), (59, 80, -1), (100, 120, 0)]
+	data = coordinates.encodeCoordinates(intervals)
+
+	assert len(data) == 36
+	assert coordinates.decodeIntervals(data) == intervals
+	assert coordinates.decodeIntervals(memoryview(data)) == intervals
+	assert coordinates.decodeIntervals(None) == []
+
+def test_decode_many():
+	first = coordinates.encodeCoordinates([(0, 10, 1), (20, 30, 1)])
+	second = coordinates.encodeCoordinates([(5, 15, -1)])
+
+	values, offsets = coordinates.decodeMany([first, None, second])
+
+	assert list(offsets) == [0, 2, 2, 3]
+	assert [ tuple(int(value) for value in values[row]) for row in range(offsets[3]) ] == [(0, 10, 1), (20, 30, 1), (5, 15, -1)]
+
+def test_location():
+	location = coordinates.toLocation( coordinates.encodeCoordinates([(0, 10, 1), (20, 30, 1)]) )
+
+	assert [ (int(part.start), int(part.end), part.strand) for part in location.parts ] == [(0, 10, 1), (20, 30, 1)]
+	assert coordinates.intervalsToLocation([(0, 10, 1)], -1).strand == -1
+	assert coordinates.intervalsToLocation([]) is None
@@ -0,0 +1,64 @@
+import re
+import random
+
+import pytest
+
+from server.recoding import SiteScanner, TypeIISEnzyme, defaultEnzymes, getEnzymes, reverseComplement
+
+def naiveSites(enzymes, seq):
+	found = set()
+	for enzymeIndex, enzyme in enumerate(enzymes):
+		for pattern, strand, replacements in enzyme.patterns():
+			for match in re.finditer('(?={0})'.format(pattern), seq):
+				found.add( (match.start(), enzymeIndex, strand) )
+	return found
+
+def test_scan_matches_naive_search():
+	random.seed(3)
+	scanner = SiteScanner()
+
+	for _ in range(50):
+		seq = ''.join( random.choice('ACGT') for _ in range(300) )
+		seq = seq[:100] + 'GGTCTC' + seq[100:200] + 'GAAGAGC' + seq[200:]
+
+		assert set( scanner.scan(seq) ) == naiveSites(defaultEnzymes, seq)
+
+def test_overlapping_patterns():
+	# Sites of different enzymes that share a suffix, and a palindrome
+	enzymes = [ TypeIISEnzyme('A', 'ACGT', ['ACGA'], ['ACGA']), TypeIISEnzyme('B', 'GTCC', ['GTCA'], ['GGAA']) ]
+	seq = 'TTACGTCCAACGT'
+
+	assert set( SiteScanner(enzymes).scan(seq) ) == naiveSites(enzymes, seq)
+
+def test_sites_by_enzyme():
+	seq = 'AAGGTCTCAAGAGACCAAGCTCTTCAA'
+	sites = SiteScanner().sites(seq)
+
+	assert list(sites.keys()) == ['BsaI', 'SapI']
+	assert sites['BsaI'] == [2, 10]
+	assert sites['SapI'] == [18]
+
+def test_recode_removes_sites():
+	seq = 'ATGGGTCTCAAAGCTCTTCGAGACCTAA'
+	scanner = SiteScanner()
+
+	newseq, sites = scanner.recode(seq)
+
+	assert len(newseq) == len(seq)
+	assert sum( len(positions) for positions in sites.values() ) == 3
+	assert not any( scanner.sites(newseq).values() )
+
+def test_reverse_complement():
+	assert reverseComplement('GGTCTCa') == 'tGAGACC'
+
+def test_get_enzymes(monkeypatch):
+	monkeypatch.delenv('MARPODB_ENZYMES', raising = False)
+	assert getEnzymes() == defaultEnzymes
+
+	monkeypatch.setenv('MARPODB_ENZYMES', 'SapI')
+	assert [ enzyme.name for enzyme in getEnzymes() ] == ['SapI']
+
+	assert [ enzyme.name for enzyme in getEnzymes('BsaI, SapI') ] == ['BsaI', 'SapI']
+
+	with pytest.raises(ValueError):
+		getEnzymes('BsaI,NotI')
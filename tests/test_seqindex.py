@@ -0,0 +1,72 @@
+import random
+
+import pytest
+
+seqindex = pytest.importorskip('server.seqindex')
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from server.tables import Base, Locus, Gene
+
+def buildIndex(directory, seqs, k = 8, smallK = 4):
+	engine = create_engine('sqlite://')
+	Base.metadata.create_all(engine, tables = [ cls.__table__ for cls in seqindex.partClasses + [Locus, Gene] ])
+
+	session = Session(engine)
+	for i, seq in enumerate(seqs):
+		session.add( seqindex.CDS(id = i + 1, dbid = 'cds{0}'.format(i), seq = seq) )
+	session.commit()
+
+	seqindex.buildSequenceIndex(session, str(directory), k = k, smallK = smallK)
+	session.close()
+
+	return seqindex.SequenceIndex(str(directory))
+
+def bruteForce(seqs, pattern, mismatches):
+	hits = set()
+	for i, seq in enumerate(seqs):
+		for strand, query in [(1, pattern), (-1, seqindex.reverseComplement(pattern))]:
+			for start in range(len(seq) - len(query) + 1):
+				if sum( 1 for a, b in zip(seq[start:start+len(query)], query) if a != b ) <= mismatches:
+					hits.add( ('cds{0}'.format(i), start + 1, strand) )
+	return hits
+
+def test_find_matches_brute_force(tmp_path):
+	random.seed(1)
+	seqs = [ ''.join( random.choice('ACGT') for _ in range(200) ) for _ in range(10) ]
+	index = buildIndex(tmp_path / 'index', seqs)
+
+	# Lengths below smallK scan, below k use the short table, the rest the main one
+	for length, mismatches in [(3, 0), (5, 0), (7, 0), (9, 0), (8, 1), (12, 2)]:
+		for i, seq in enumerate(seqs):
+			pattern = seq[20 + i : 20 + i + length]
+			hits = index.find(pattern, mismatches, 100000)
+
+			assert set( (hit['dbid'], hit['start'], hit['strand']) for hit in hits ) == bruteForce(seqs, pattern, mismatches)
+
+	index.close()
+
+def test_matches_do_not_span_records(tmp_path):
+	index = buildIndex(tmp_path / 'index', ['AAAACCCC', 'GGGGAAAA'])
+
+	assert index.find('CCCCGGGG') == []
+	assert [ hit['dbid'] for hit in index.find('AAAACC') ] == ['cds0']
+
+	index.close()
+
+def test_empty_database(tmp_path):
+	index = buildIndex(tmp_path / 'index', [])
+
+	assert index.find('ACGTACGTAC') == []
+	assert index.find('ACG') == []
+
+	index.close()
+
+def test_too_many_mismatches(tmp_path):
+	index = buildIndex(tmp_path / 'index', ['ACGTACGTACGT'])
+
+	with pytest.raises(ValueError):
+		index.find('ACGTAC', 2)
+
+	index.close()
@@ -0,0 +1,31 @@
+import random
+
+import pytest
+
+system = pytest.importorskip('server.system')
+
+def test_keeps_k_best_in_order():
+	top = system.TopHits(3)
+	for key in [5, 1, 4, 2, 3]:
+		top.push(key, 'hit{0}'.format(key))
+
+	assert top.hits() == ['hit1', 'hit2', 'hit3']
+	assert top.bestKey() == 1
+	assert top.count == 5
+
+def test_matches_stable_sort():
+	random.seed(7)
+	hits = [ (random.randint(0, 10), i) for i in range(200) ]
+
+	top = system.TopHits(10)
+	for key, hit in hits:
+		top.push(key, hit)
+
+	assert top.hits() == [ hit for key, hit in sorted(hits, key = lambda item: item[0])[:10] ]
+
+def test_fewer_hits_than_k():
+	top = system.TopHits(5)
+	top.push(2.0, 'b')
+	top.push(1.0, 'a')
+
+	assert top.hits() == ['a', 'b']